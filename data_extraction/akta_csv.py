@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+from export_schema import CHANNELS, curve_names_by_column, resolve_schema
+
+# text columns read besides the schema channels (get_start_stop_idx reads the logbook by name)
+TEXT_COLUMNS = ('Logbook',)
+
+
+def mangle_names(names):
+    """
+    This function takes in the header cells of an export and returns the column names pandas gives them
+    ('Unnamed: <i>' for empty cells, '.1', '.2' ... suffixes for repeated names).
+    Args:
+        names: list of header cells
+    Returns:
+        names: list of column names
+    """
+    names = [name if name else f'Unnamed: {i}' for i, name in enumerate(names)]
+    counts = {}
+    for i, name in enumerate(names):
+        count = counts.get(name, 0)
+        while count > 0:
+            counts[name] = count + 1
+            name = f'{name}.{count}'
+            count = counts.get(name, 0)
+        names[i] = name
+        counts[name] = count + 1
+    return names
+
+def sniff_header(path):
+    """
+    This function takes in the path of a UTF-16 AKTA csv export and reads its two header rows.
+    Args:
+        path: path of the csv file
+    Returns:
+        curve_names: curve name row (the name sits above the ml column of every curve)
+        columns: column names of the unit row, as pd.read_csv(skiprows=[0,1]) names them
+    """
+    with open(path, encoding='utf_16') as f:
+        f.readline()
+        curve_names = f.readline().rstrip('\r\n').split('\t')
+        units = f.readline().rstrip('\r\n').split('\t')
+    return curve_names, mangle_names(units)
+
+def read_akta_csv(path, texts=TEXT_COLUMNS):
+    """
+    This function takes in the path of a UTF-16 AKTA csv export and returns the channels of its schema only.
+    Curves are parsed as float32, the ml columns stay float64 so the volumes written to the feature tables
+    do not change, logbook/fraction columns are read as categorical text.
+    The column order of the export is kept, so every value column still follows its ml column.
+    Args:
+        path: path of the csv file
+        texts: further text columns (unit header) to read
+    Returns:
+        df: dataframe, df.attrs['curves'] maps every value column to its UNICORN curve name
+    Raises:
+        ValueError: if the header does not resolve to the channels of the schema
+    """
+    curve_names, columns = sniff_header(path)
+    curves = curve_names_by_column(columns, curve_names)
+    schema = resolve_schema(columns, curves)
+    dtypes = {}
+    for channel, (ml_col, col) in schema.items():
+        dtypes[ml_col] = np.float64
+        dtypes[col] = np.float32 if channel in CHANNELS and CHANNELS[channel][1] else 'category'
+    for i, name in enumerate(columns):
+        if i > 0 and name in texts:
+            dtypes[columns[i - 1]] = np.float64
+            dtypes[name] = 'category'
+    usecols = [i for i, name in enumerate(columns) if name in dtypes]
+    df = pd.read_csv(path, skiprows=[0, 1, 2], header=None, names=columns, usecols=usecols, dtype=dtypes,
+                     delimiter='\t', encoding='utf_16', on_bad_lines='skip')
+    df.attrs['curves'] = {col: curve for col, curve in curves.items() if col in dtypes}
+    return df
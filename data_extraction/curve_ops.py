@@ -0,0 +1,211 @@
+import numpy as np
+
+
+def valid_curve(ml, values):
+    """
+    This function takes in the ml and value column of a curve and returns them as float arrays without
+    the NaN padding that shorter curves get at the end of a dataframe.
+    Args:
+        ml: volumes of the curve (sorted)
+        values: values of the curve
+    Returns:
+        ml: float array
+        values: float array
+    """
+    ml = np.asarray(ml, dtype=float)
+    values = np.asarray(values, dtype=float)
+    n = min(np.count_nonzero(~np.isnan(ml)), len(values))
+    return ml[:n], values[:n]
+
+def values_at_volumes(ml, values, volumes, interpolate=False):
+    """
+    This function takes in a curve and a list of volumes and returns the curve value at every volume
+    with one batched binary search.
+    Args:
+        ml: volumes of the curve (sorted)
+        values: values of the curve
+        volumes: volumes to look up
+        interpolate: if False, the value of the first sample at or after each volume is returned,
+                     if True, the value is linearly interpolated between the neighbouring samples
+    Returns:
+        result: float array, NaN for volumes outside the curve
+    """
+    ml, values = valid_curve(ml, values)
+    volumes = np.atleast_1d(np.asarray(volumes, dtype=float))
+    if len(ml) == 0:
+        return np.full(volumes.shape, np.nan)
+    if interpolate:
+        return np.interp(volumes, ml, values, left=np.nan, right=np.nan)
+    idx = np.searchsorted(ml, volumes, side="left")
+    result = values[np.minimum(idx, len(ml) - 1)]
+    result[(idx >= len(ml)) | np.isnan(volumes)] = np.nan
+    return result
+
+def cumulative_integral(ml, values):
+    """
+    This function takes in a curve and returns its cumulative trapezoid integral over the volume axis.
+    Args:
+        ml: volumes of the curve
+        values: values of the curve
+    Returns:
+        area: float array, area[i] is the integral from the first sample to sample i (value*ml)
+    """
+    ml = np.asarray(ml, dtype=float)
+    values = np.asarray(values, dtype=float)
+    return np.append(0, np.cumsum((values[1:] + values[:-1]) / 2 * np.diff(ml)))
+
+def window_stats(ml, values, boundaries, groups=None):
+    """
+    This function takes in a curve and the volumes where its windows (e.g. the phases of a run) start and
+    returns mean, std, min, max, slope and integral of every window with one reduceat pass per statistic.
+    Window k runs from boundaries[k] to boundaries[k + 1], the last one to the end of the curve.
+    Windows with the same group (e.g. a phase that is run twice) are pooled into one.
+    Args:
+        ml: volumes of the curve (sorted)
+        values: values of the curve
+        boundaries: start volumes of the windows (sorted)
+        groups: group (0, 1, ...) of every window (default: every window on its own)
+    Returns:
+        stats: dictionary with mean, std, min, max, slope (value per ml, least squares) and integral
+               (trapezoid from boundary to boundary, value*ml, as CurveIntegral.between) arrays,
+               one entry per group, NaN for groups without samples
+    """
+    ml, values = valid_curve(ml, values)
+    boundaries = np.atleast_1d(np.asarray(boundaries, dtype=float))
+    groups = np.arange(len(boundaries)) if groups is None else np.asarray(groups, dtype=int)
+    n_groups = groups.max() + 1 if len(groups) else 0
+    n = len(ml)
+    starts = np.searchsorted(ml, boundaries, side="left")
+    ends = np.append(starts[1:], n)
+    counts = ends - starts
+    full = counts > 0
+    stats = {key: np.full(n_groups, np.nan) for key in ('mean', 'std', 'min', 'max', 'slope', 'integral')}
+    if not full.any():
+        return stats
+    # reduceat needs non-empty windows, empty ones are left out; the others tile ml[s[0]:]
+    s, c, g = starts[full], counts[full], groups[full]
+    x, y = ml[s[0]:], values[s[0]:]
+    offsets = s - s[0]
+    window = np.repeat(np.arange(len(s)), c)
+    mean_x = np.add.reduceat(x, offsets) / c
+    mean_y = np.add.reduceat(y, offsets) / c
+    dx, dy = x - mean_x[window], y - mean_y[window]
+    sxx = np.add.reduceat(dx * dx, offsets)
+    syy = np.add.reduceat(dy * dy, offsets)
+    sxy = np.add.reduceat(dx * dy, offsets)
+    # pool the centered sums of the windows of every group
+    total = np.bincount(g, c, n_groups)
+    has_samples = total > 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        group_x = np.bincount(g, c * mean_x, n_groups) / total
+        group_y = np.bincount(g, c * mean_y, n_groups) / total
+        shift_x, shift_y = mean_x - group_x[g], mean_y - group_y[g]
+        group_sxx = np.bincount(g, sxx + c * shift_x * shift_x, n_groups)
+        group_syy = np.bincount(g, syy + c * shift_y * shift_y, n_groups)
+        group_sxy = np.bincount(g, sxy + c * shift_x * shift_y, n_groups)
+        stats['mean'] = np.where(has_samples, group_y, np.nan)
+        stats['std'] = np.where(has_samples, np.sqrt(group_syy / total), np.nan)
+        stats['slope'] = np.where(has_samples & (group_sxx > 0), group_sxy / group_sxx, np.nan)
+    window_min = np.full(n_groups, np.inf)
+    window_max = np.full(n_groups, -np.inf)
+    np.minimum.at(window_min, g, np.minimum.reduceat(y, offsets))
+    np.maximum.at(window_max, g, np.maximum.reduceat(y, offsets))
+    stats['min'] = np.where(has_samples, window_min, np.nan)
+    stats['max'] = np.where(has_samples, window_max, np.nan)
+    # the integral includes the parts between the boundaries and their neighbouring samples
+    stops = np.append(boundaries[1:], ml[-1])
+    area = np.bincount(groups, CurveIntegral(ml, values).between(boundaries, stops), n_groups)
+    stats['integral'] = np.where(has_samples, area, np.nan)
+    return stats
+
+def curve_window(ml, values, start, stop):
+    """
+    This function takes in a curve and a volume range and returns the part of the curve inside the range
+    (start <= ml <= stop) as views of the input arrays, found by binary search on the ml axis.
+    Args:
+        ml: volumes of the curve (sorted, a NaN padding at the end is allowed)
+        values: values of the curve
+        start: first volume of the range
+        stop: last volume of the range
+    Returns:
+        ml: array slice
+        values: array slice
+    """
+    ml = np.asarray(ml)
+    values = np.asarray(values)
+    lo = np.searchsorted(ml, start, side="left")
+    hi = min(np.searchsorted(ml, stop, side="right"), len(values))
+    return ml[lo:hi], values[lo:hi]
+
+def index_to_volume(volume, positions):
+    """
+    This function takes in the volume axis of a curve and fractional sample positions (e.g. the interpolated
+    positions of peak_widths) and returns the volume at every position, linearly interpolated between samples.
+    Args:
+        volume: volumes of the curve
+        positions: sample positions (float)
+    Returns:
+        volumes: float array
+    """
+    volume = np.asarray(volume, dtype=float)
+    return np.interp(np.asarray(positions, dtype=float), np.arange(len(volume)), volume)
+
+class CurveIntegral:
+    """
+    This class holds the cumulative trapezoid integral of a curve, computed once, and returns the exact
+    area of any number of windows (peaks, fractions, phases) with O(1) work per window.
+    Args:
+        ml: volumes of the curve (sorted within every run, several runs may be concatenated)
+        values: values of the curve
+    Attributes:
+        ml: float array
+        values: float array
+        area: cumulative integral (see cumulative_integral)
+    """
+    def __init__(self, ml, values):
+        self.ml, self.values = valid_curve(ml, values)
+        self.area = cumulative_integral(self.ml, self.values)
+
+    def at_positions(self, positions):
+        """
+        This function takes in fractional sample positions and returns the integral from the first sample
+        up to every position, the curve being linear between samples.
+        Args:
+            positions: sample positions (float, e.g. the interpolated positions of peak_widths)
+        Returns:
+            area: float array
+        """
+        n = len(self.ml)
+        positions = np.clip(np.asarray(positions, dtype=float), 0, max(n - 1, 0))
+        if n < 2:
+            return np.zeros(positions.shape)
+        i = np.minimum(positions.astype(int), n - 2)
+        f = positions - i
+        dx = self.ml[i + 1] - self.ml[i]
+        y0 = self.values[i]
+        return self.area[i] + f * dx * (y0 + f * (self.values[i + 1] - y0) / 2)
+
+    def between_positions(self, left, right):
+        """
+        This function takes in the fractional sample positions where windows start and end and returns their areas.
+        Positions work on concatenated runs as well (add the run offset of every window).
+        Args:
+            left: start positions of the windows
+            right: end positions of the windows
+        Returns:
+            area: float array (value*ml)
+        """
+        return self.at_positions(right) - self.at_positions(left)
+
+    def between(self, start, stop):
+        """
+        This function takes in the volumes where windows start and end and returns their areas
+        (the curve must be a single run, windows are clipped to the curve).
+        Args:
+            start: start volumes of the windows
+            stop: end volumes of the windows
+        Returns:
+            area: float array (value*ml)
+        """
+        index = np.arange(len(self.ml))
+        return self.between_positions(np.interp(start, self.ml, index), np.interp(stop, self.ml, index))
@@ -0,0 +1,75 @@
+import re
+from functools import lru_cache
+
+# channel: (UNICORN curve names in order of preference, unit of the value column or None for text channels)
+CHANNELS = {'pH': ([r'^pH$'], 'pH'),
+            'UV_280': ([r'^UV ?\d?_?280'], 'mAU'),
+            'UV_260': ([r'^UV ?\d?_?260'], 'mAU'),
+            'Conductivity': ([r'^Cond(uctivity)?$'], 'mS/cm'),
+            'Sample Flow': ([r'^Sample flow'], 'CV/h'),
+            'System Flow': ([r'^System flow'], 'CV/h'),
+            'Sample Pressure': ([r'^Sample pressure'], 'MPa'),
+            'System Pressure': ([r'^System pressure'], 'MPa'),
+            'Run Log': ([r'^Run Log$', r'^Logbook$'], None)}
+# channels added to the schema only when the export has them
+OPTIONAL_CHANNELS = {'Injection': ([r'^Injection$'], None)}
+
+
+def curve_names_by_column(columns, curve_row):
+    """
+    This function takes in the column names of an export and its curve name row (the name of every curve
+    sits above its ml column) and returns the curve name of every value column.
+    Args:
+        columns: column names of the dataframe
+        curve_row: cells of the curve name row, aligned with columns
+    Returns:
+        curves: dictionary with value column: curve name pairs
+    """
+    columns = list(columns)
+    return {columns[i + 1]: name.strip() for i, name in enumerate(curve_row)
+            if isinstance(name, str) and name.strip() and i + 1 < len(columns)}
+
+def _find_channel(channel, patterns, unit, pairs):
+    for pattern in patterns:
+        matches = [pair for pair in pairs if re.search(pattern, pair[0], re.IGNORECASE)]
+        if len(matches) > 1:
+            raise ValueError(f'{channel}: curves {[m[0] for m in matches]} are ambiguous')
+        if matches:
+            curve, ml_col, col = matches[0]
+            if not ml_col.startswith('ml'):
+                raise ValueError(f'{channel}: curve {curve} has no ml column in front of {col}')
+            if unit is not None and re.sub(r'\.\d+$', '', col) != unit:
+                raise ValueError(f'{channel}: curve {curve} is in {col}, expected {unit}')
+            return [ml_col, col]
+    return None
+
+@lru_cache(maxsize=None)
+def _resolve_schema(columns, curves):
+    pairs = [(curve, columns[i - 1], col) for i, (col, curve) in enumerate(zip(columns, curves)) if curve and i > 0]
+    schema = {}
+    for channel, (patterns, unit) in CHANNELS.items():
+        found = _find_channel(channel, patterns, unit, pairs)
+        if found is None:
+            raise ValueError(f'{channel}: no curve in {sorted(set(curves) - {""})}')
+        schema[channel] = found
+    for channel, (patterns, unit) in OPTIONAL_CHANNELS.items():
+        found = _find_channel(channel, patterns, unit, pairs)
+        if found is not None:
+            schema[channel] = found
+    return schema
+
+def resolve_schema(columns, curves):
+    """
+    This function takes in the header of an export and returns the ml and value column of every channel,
+    matched on the UNICORN curve names. The mapping is computed once per header layout.
+    Args:
+        columns: column names of the dataframe
+        curves: dictionary with value column: curve name pairs (see curve_names_by_column)
+    Returns:
+        data_dict: dictionary with channel: [ml column, value column] pairs, as load_useful_data returns it
+    Raises:
+        ValueError: if a channel is missing, ambiguous or in an unexpected unit
+    """
+    columns = tuple(columns)
+    schema = _resolve_schema(columns, tuple(curves.get(col, '') for col in columns))
+    return {channel: list(cols) for channel, cols in schema.items()}
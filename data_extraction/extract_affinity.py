@@ -0,0 +1,68 @@
+import os
+import pandas as pd
+from run_cache import read_csv_cached
+from manifest import load_manifest, save_manifest, update_manifest, feature_table
+from parallel_extract import stage, failure_record, extract_files, save_failures
+import extract_matrix
+import extract_peaks
+
+# full rebuild of affinity_data.csv and peak_metrics.csv, every export is read once for both tables
+failure_file = 'affinity_failures.csv'
+workers = os.cpu_count()
+
+
+def affinity_rows(csv):
+    """
+    This function takes in the path of an AKTA csv export, reads it once and returns its rows of the
+    affinity data and the peak metrics table.
+    Args:
+        csv: path of the csv file
+    Returns:
+        row: dictionary with the columns of the affinity data table
+        peak_row: dictionary with the columns of the peak metrics table, None if there is no elution window
+        peak_failure: failure record of the peak metrics, None if they did not fail
+    Raises:
+        StageError: tagged with the stage (read, metadata, schema, features) that failed
+    """
+    with stage('read'):
+        df = read_csv_cached(csv)
+    row = extract_matrix.matrix_features(csv, df)
+    try:
+        with stage('peaks'):
+            return row, extract_peaks.peak_features(csv, df), None
+    except Exception as e:
+        return row, None, failure_record(csv, e)
+
+
+if __name__ == '__main__':
+    CSVs = []
+    for root, dirs, files in os.walk("Affinity Data"):
+        for file in files:
+            if file.endswith(".csv"):
+                CSVs.append(os.path.join(root, file))
+
+    manifest = load_manifest(extract_matrix.manifest_file)
+    rows = {}
+    peak_rows = {}
+    failures = []
+    for csv, result, failure in extract_files(CSVs, affinity_rows, workers):
+        if failure is not None:
+            print(failure['exception'], failure['message'], csv)
+            failures.append(failure)
+            continue
+        rows[csv], peak_row, peak_failure = result
+        update_manifest(manifest, csv, extract_matrix.EXTRACTION_VERSION)
+        if peak_failure is not None:
+            print(peak_failure['exception'], peak_failure['message'], csv)
+            failures.append(peak_failure)
+        elif peak_row is not None:
+            peak_rows[csv] = peak_row
+
+    # both tables are written in walk order and share the file and path columns
+    data = feature_table([rows[csv] for csv in CSVs if csv in rows], extract_matrix.columns)
+    data = extract_matrix.enrich_column_data(data)
+    data.to_csv('affinity_data.csv', index=False)
+    peak_data = pd.DataFrame([peak_rows[csv] for csv in CSVs if csv in peak_rows], columns=extract_peaks.columns)
+    peak_data.to_csv(extract_peaks.output_file, index=False)
+    save_manifest(manifest, extract_matrix.manifest_file)
+    save_failures(failures, failure_file)
@@ -6,80 +6,126 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from utils import *
+from run_cache import read_csv_cached
+from manifest import load_manifest, save_manifest, changed_files, update_manifest, merge_table, feature_table
+from parallel_extract import stage, extract_files, save_failures
 
-CSVs = []
-for root, dirs, files in os.walk("Affinity Data"):
-    for file in files:
-        if file.endswith(".csv"):
-             CSVs.append(os.path.join(root, file))
+# bump to re-extract every file after a change of the feature code
+EXTRACTION_VERSION = 5
+manifest_file = 'affinity_data_manifest.csv'
+failure_file = 'affinity_data_failures.csv'
+workers = os.cpu_count()
 
+# serotypes that were only run on AAVX, used when the resin is not in the file name
+AAVX_SEROTYPES = ['AAV2', 'AAV6', 'AAV9', 'AAV9_with_LigaGuard']
+DEFAULT_COLUMN_VOLUME = 0.5
+# column volume (mL) -> diameter (mm) and bed height (cm), the height of the 10 mm columns follows from the volume
+COLUMN_HARDWARE = pd.DataFrame({'Column Volume (mL)': [0.5, 3.3, 4.0], 'Column Diameter (mm)': [5.0, 10.0, 10.0]})
+COLUMN_HARDWARE['Coulmn Height (cm)'] = np.where(
+    COLUMN_HARDWARE['Column Volume (mL)'] == 0.5, 2.55,
+    (COLUMN_HARDWARE['Column Volume (mL)']*1000 / (np.pi*(COLUMN_HARDWARE['Column Diameter (mm)']/2)**2) / 10).round(2))
 
-frame = {'resin': [], 'serotype': [], 'file': [], 'Column Volume (mL)':[], 'Pure':[], 'Blank':[],
-         'Elution pH': [],'Wash pH': [],'Equlibration pH': [],'Elution Conductivity': [],
-         'Wash Conductivity': [],'Equilibration Conductivity': [], 'Sample Volume (mL)':[],
-         'System Flowrate Elution (CV/h)': [], 'Sample Flowrate Elution (CV/h)': []}
-for csv in CSVs:
-    name = csv.split('/')[-1][:-4]
-    resin, serotype = get_resin_and_serotype(name)
-    if resin == 'U':
-        resin = get_resin(name)
-    if serotype == 'U':
-        serotype = csv.split('/')[1]
-    pure = is_pure(name)
-    col_vol = get_column_volume(name)
-    blank = is_blank(name)
-    # print(csv)
-    try:
-        df = pd.read_csv(csv, skiprows = [0,1], delimiter='\t', encoding='utf_16', on_bad_lines='skip', low_memory=False)
+columns = ['resin', 'serotype', 'file', 'path', 'Column Volume (mL)', 'Pure', 'Blank',
+           'Elution pH', 'Wash pH', 'Equlibration pH', 'Elution Conductivity',
+           'Wash Conductivity', 'Equilibration Conductivity', 'Sample Volume (mL)',
+           'System Flowrate Elution (CV/h)', 'Sample Flowrate Elution (CV/h)']
+
+
+def matrix_features(csv, df):
+    """
+    This function takes in the path and the dataframe of an AKTA csv export and returns its row of the
+    affinity data table.
+    Args:
+        csv: path of the csv file
+        df: dataframe read by read_csv_cached
+    Returns:
+        row: dictionary with the columns of the affinity data table
+    Raises:
+        StageError: tagged with the stage (metadata, schema, features) that failed
+    """
+    with stage('metadata'):
+        name = csv.split('/')[-1][:-4]
+        resin, serotype = get_resin_and_serotype(name)
+        if resin == 'U':
+            resin = get_resin(name)
+        if serotype == 'U':
+            serotype = csv.split('/')[1]
+        pure = is_pure(name)
+        col_vol = get_column_volume(name)
+        blank = is_blank(name)
+    with stage('schema'):
         data_dict = load_useful_data(df)
-    except Exception as e:
-        print(e, csv)
-    
-    try:
+    with stage('features'):
         elution_ph, elution_cond = get_ph_and_cond_at_elution(df, data_dict)
         wash_ph, wash_cond = get_ph_and_cond_at_wash(df, data_dict)
         sample_flow, system_flow = get_sample_and_sytem_flow_rate_at_elution(df, data_dict)
         equilibration_ph, equilibration_cond = get_ph_and_cond_at_equilibration(df, data_dict)
         sample_volume = get_sample_volume(df, data_dict)
-        frame['resin'].append(resin)
-        frame['serotype'].append(serotype)
-        frame['file'].append(name)
-        frame['Pure'].append(pure)
-        frame['Blank'].append(blank)
-        frame['Column Volume (mL)'].append(col_vol[:-2])
-        frame['Elution pH'].append(elution_ph)
-        frame['Wash pH'].append(wash_ph)
-        frame['Equlibration pH'].append(equilibration_ph)
-        frame['Elution Conductivity'].append(elution_cond)
-        frame['Wash Conductivity'].append(wash_cond)
-        frame['Equilibration Conductivity'].append(equilibration_cond)
-        frame['Sample Volume (mL)'].append(sample_volume)
-        frame['System Flowrate Elution (CV/h)'].append(system_flow)
-        frame['Sample Flowrate Elution (CV/h)'].append(sample_flow)
-    except Exception as e:
-        print(e, csv)
+        phase_features = get_phase_features(df, data_dict, all_phases=True, phase_stats=True)
+    return {'resin': resin, 'serotype': serotype, 'file': name, 'path': csv, 'Column Volume (mL)': col_vol[:-2],
+            'Pure': pure, 'Blank': blank, 'Elution pH': elution_ph, 'Wash pH': wash_ph,
+            'Equlibration pH': equilibration_ph, 'Elution Conductivity': elution_cond,
+            'Wash Conductivity': wash_cond, 'Equilibration Conductivity': equilibration_cond,
+            'Sample Volume (mL)': sample_volume, 'System Flowrate Elution (CV/h)': system_flow,
+            'Sample Flowrate Elution (CV/h)': sample_flow, **phase_features}
+
+def matrix_row(csv):
+    """
+    This function takes in the path of an AKTA csv export and returns its row of the affinity data table.
+    Args:
+        csv: path of the csv file
+    Returns:
+        row: dictionary with the columns of the affinity data table
+    Raises:
+        StageError: tagged with the stage (metadata, read, schema, features) that failed
+    """
+    with stage('read'):
+        df = read_csv_cached(csv)
+    return matrix_features(csv, df)
+
+def enrich_column_data(data):
+    """
+    This function takes in the affinity data table and fills in the resin of the AAVX runs and the
+    column geometry from COLUMN_HARDWARE. Runs without a column volume in the name get the 0.5 mL column.
+    Args:
+        data: dataframe with the columns of the affinity data table
+    Returns:
+        data: dataframe with numeric Column Volume (mL), Column Diameter (mm) and Coulmn Height (cm) columns
+              (NaN for column volumes that are not in COLUMN_HARDWARE)
+    """
+    aavx = (data['resin'] == 'U') & data['serotype'].isin(AAVX_SEROTYPES)
+    data.loc[aavx, 'resin'] = 'AAVX'
 
-data = pd.DataFrame(frame)
-data[['Column Diameter (mm)', 'Coulmn Height (cm)']] = 'U'
+    volume = pd.to_numeric(data['Column Volume (mL)'].replace('', np.nan), errors='coerce')
+    data['Column Volume (mL)'] = volume.fillna(DEFAULT_COLUMN_VOLUME)
+    data = data.drop(columns=['Column Diameter (mm)', 'Coulmn Height (cm)'], errors='ignore')
+    return data.merge(COLUMN_HARDWARE, on='Column Volume (mL)', how='left', validate='many_to_one')
 
+if __name__ == '__main__':
+    CSVs = []
+    for root, dirs, files in os.walk("Affinity Data"):
+        for file in files:
+            if file.endswith(".csv"):
+                CSVs.append(os.path.join(root, file))
 
-for i in range(len(data)):
-    if data['resin'][i] == 'U' and (data['serotype'][i] in ['AAV2', 'AAV6', 'AAV9', 'AAV9_with_LigaGuard']):
-        # data['resin'][i] = 'AAVX'
-        data.loc[i, 'resin'] = 'AAVX'
+    manifest = load_manifest(manifest_file)
+    CSVs = changed_files(CSVs, manifest, EXTRACTION_VERSION)
 
-for i in range(len(data)):
-    if data['Column Volume (mL)'][i] == '':
-        data.loc[i, ['Coulmn Height (cm)', 'Column Diameter (mm)', 'Column Volume (mL)']] = [2.55, 5, 0.5]
+    rows = {}
+    failures = []
+    for csv, row, failure in extract_files(CSVs, matrix_row, workers):
+        if failure is not None:
+            print(failure['exception'], failure['message'], csv)
+            failures.append(failure)
+            continue
+        rows[csv] = row
+        update_manifest(manifest, csv, EXTRACTION_VERSION)
 
-for i in range(len(data)):
-    if float(data['Column Volume (mL)'][i]) in [3.3, 4.0]:
-        data.loc[i, 'Column Diameter (mm)'] = 10
-        if data['Column Volume (mL)'][i] != 'U' and data['Coulmn Height (cm)'][i] != '':
-            height = (float(data['Column Volume (mL)'][i])*1000)/(np.pi*((10/2)**2))
-            data.loc[i,'Coulmn Height (cm)'] = round(height/10, 2)
-    elif float(data['Column Volume (mL)'][i]) == 0.5:
-        data.loc[i, 'Column Diameter (mm)'] = 5
-        data.loc[i,'Coulmn Height (cm)'] = 2.55
+    data = feature_table([rows[csv] for csv in CSVs if csv in rows], columns)
+    data = enrich_column_data(data)
 
-data.to_csv('affinity_data.csv', index=False)
\ No newline at end of file
+    # rows of a file that failed are kept until it is extracted again
+    data = merge_table('affinity_data.csv', data, list(rows))
+    data.to_csv('affinity_data.csv', index=False)
+    save_manifest(manifest, manifest_file)
+    save_failures(failures, failure_file)
@@ -10,87 +10,99 @@ import matplotlib.pyplot as plt
 from scipy.signal import find_peaks, peak_widths, savgol_filter, convolve, peak_prominences
 from peak_metrics import *
 from utils import *
+from run_cache import read_csv_cached
+from parallel_extract import stage, extract_files, save_failures
 
 
-CSVs = []
-for root, dirs, files in os.walk("Affinity Data"):
-    for file in files:
-        if file.endswith(".csv"):
-             CSVs.append(os.path.join(root, file))
+output_file = 'peak_metrics.csv'
+failure_file = 'peak_metrics_failures.csv'
+workers = os.cpu_count()
 
+columns = ['file', 'path', 'Tailing Factor', 'Peak Assymetry', 'No. Theoretical Plates', 'Area (mAU*ml)',
+           'Integrated Area (mAU*ml)', 'Height', 'No. Elutions']
 
-frame = {'file': [], 'Tailing Factor': [], 'Peak Assymetry': [], 'No. Theoretical Plates': [], 'Area (mAU*ml)':[], 'Height':[], 'No. Elutions': []}
 
-count = 0
-errors = []
-for csv in CSVs:
+def peak_features(csv, df):
+    """
+    This function takes in the path and the dataframe of a run and returns the metrics of the elution peaks.
+    Args:
+        csv: path of the csv file
+        df: dataframe read by read_csv_cached
+    Returns:
+        row: dictionary with the columns of the peak metrics table, None if the run has no elution window
+    """
     name = csv.split('/')[-1][:-4]
-    resin, serotype = get_resin_and_serotype(name)
-    if resin == 'U':
-        resin = get_resin(name)
-    if serotype == 'U':
-        serotype = csv.split('/')[1]
-    # print(csv)
-    try:
-        df = pd.read_csv(csv, skiprows = [0,1], delimiter='\t', encoding='utf_16', on_bad_lines='skip', low_memory=False)
-    except Exception as e:
-        print(e, csv)
+    # column_wash_idx, cip_idx = get_elution_and_cip_idx(df)
+    start_idx, stop_idx, two_elutions = get_start_stop_idx(df)
 
-    try:
+    data = load_useful_data(df)
 
-        # column_wash_idx, cip_idx = get_elution_and_cip_idx(df)
-        start_idx, stop_idx, two_elutions = get_start_stop_idx(df)
+    if start_idx == None or stop_idx == None:
+        return None
+    start = df[data['Run Log']].loc[start_idx].values[0]
+    stop = df[data['Run Log']].loc[stop_idx].values[0]
 
-        data = load_useful_data(df)
+    volume, uv_280 = get_channel_windows(df, data, start, stop)['UV_280']
+    # only positive volumes and absorbances are analysed
+    positive = (volume > 0) & (uv_280 > 0)
+    volume = volume[positive]
+    uv_280 = uv_280[positive]
+    # mid_absorbance = max(uv_280) / 2
+    eighty_five_percent_of_max_adsorbance = uv_280.max() * 0.85
+    peaks, info = find_peaks(uv_280, height=eighty_five_percent_of_max_adsorbance, width=15)
+    # find_peaks already computed the prominences (width=15), every width level reuses them
+    prominence_data = (info['prominences'], info['left_bases'], info['right_bases'])
+    results_half, results_full, results_five_pec, results_ten_pec = peak_widths_at(
+        uv_280, peaks, [0.5, 1, 0.95, 0.9], prominence_data)
+    prominences = prominence_data[0]
+    contour_heights = uv_280[peaks] - prominences
 
-        if start_idx != None and stop_idx != None:
-            count += 1
-            start = df[data['Run Log']].loc[start_idx].values[0]
-            stop = df[data['Run Log']].loc[stop_idx].values[0]
+    half_width = query_line(volume, results_half[1:])
+    full_width = query_line(volume, results_full[1:])
+    ten_percent_width = query_line(volume, results_ten_pec[1:])
+    five_percent_width = query_line(volume, results_five_pec[1:])
+    # show_peaks(name, uv_280, volume, peaks, half_width, contour_heights)
+    return {'file': name, 'path': csv,
+            'Tailing Factor': tailing_factor(peaks, results_five_pec[1:]).tolist(),
+            'Peak Assymetry': peak_assymetry(peaks, results_ten_pec[1:]).tolist(),
+            'No. Theoretical Plates': number_of_theoretical_plates(volume, peaks, results_half[1:]).tolist(),
+            'Area (mAU*ml)': area(volume, peaks, results_full[1:], prominences).tolist(),
+            'Integrated Area (mAU*ml)': integrated_area(volume, uv_280, results_full[1:]).tolist(),
+            'Height': peak_height(peaks, prominences).tolist(),
+            'No. Elutions': 2 if two_elutions == True else 1}
 
-            
-            cols = df[data['UV_280']].columns
-            volume = df[data['UV_280']][cols[0]]
-            uv_280 = df[data['UV_280']][cols[1]]
+def peak_row(csv):
+    """
+    This function takes in the path of an AKTA csv export and returns its row of the peak metrics table.
+    Args:
+        csv: path of the csv file
+    Returns:
+        row: dictionary with the columns of the peak metrics table, None if the run has no elution window
+    Raises:
+        StageError: tagged with the stage (read, peaks) that failed
+    """
+    with stage('read'):
+        df = read_csv_cached(csv)
+    with stage('peaks'):
+        return peak_features(csv, df)
 
-            volume = volume.apply(lambda x: 0 if x < start else x)
-            volume = volume.apply(lambda x: 0 if x > stop else x)
-            volume = volume.loc[volume > 0]
 
-            uv_280 = uv_280[volume.index]
-            uv_280  = uv_280.apply(lambda x: 0 if x < 0 else x)
-            uv_280 = uv_280.loc[uv_280 > 0]
-            uv_280.dropna(inplace=True)
-            volume = volume.loc[uv_280.index]
-            uv_280.reset_index(drop=True, inplace=True)
-            volume.reset_index(drop=True, inplace=True)
-            # mid_absorbance = max(uv_280) / 2
-            eighty_five_percent_of_max_adsorbance = max(uv_280) * 0.85
-            peaks, info = find_peaks(uv_280, height=eighty_five_percent_of_max_adsorbance, width=15)
-            results_half = peak_widths(uv_280, peaks, rel_height=0.5)
-            results_full = peak_widths(uv_280, peaks, rel_height=1)
-            results_five_pec = peak_widths(uv_280, peaks, rel_height=0.95)
-            results_ten_pec = peak_widths(uv_280, peaks, rel_height=0.9)
-            prominences = peak_prominences(uv_280, peaks)[0]
-            contour_heights = uv_280[peaks] - prominences
+if __name__ == '__main__':
+    CSVs = []
+    for root, dirs, files in os.walk("Affinity Data"):
+        for file in files:
+            if file.endswith(".csv"):
+                CSVs.append(os.path.join(root, file))
 
-            half_width = query_line(volume, results_half[1:])
-            full_width = query_line(volume, results_full[1:])
-            ten_percent_width = query_line(volume, results_ten_pec[1:])
-            five_percent_width = query_line(volume, results_five_pec[1:])
-            frame['file'].append(name)
-            frame['Tailing Factor'].append(tailing_factor(peaks, results_five_pec[1:]))
-            frame['Peak Assymetry'].append(peak_assymetry(peaks, results_ten_pec[1:]))
-            frame['No. Theoretical Plates'].append(number_of_theoretical_plates(volume, peaks, results_half[1:]))
-            frame['Area (mAU*ml)'].append(area(volume, peaks, results_full[1:], prominences))
-            frame['Height'].append(peak_height(peaks, prominences))
-            if two_elutions == True:
-                frame['No. Elutions'].append(2)
-            else:
-                frame['No. Elutions'].append(1)
-            # show_peaks(name, uv_280, volume, peaks, half_width, contour_heights)
-    except Exception as e:
-        print(e, csv)
-data = pd.DataFrame(frame)
-data.to_csv('peak_metrics.csv', index=False)
+    rows = {}
+    failures = []
+    for csv, row, failure in extract_files(CSVs, peak_row, workers):
+        if failure is not None:
+            print(failure['exception'], failure['message'], csv)
+            failures.append(failure)
+        elif row is not None:
+            rows[csv] = row
 
+    data = pd.DataFrame([rows[csv] for csv in CSVs if csv in rows], columns=columns)
+    data.to_csv(output_file, index=False)
+    save_failures(failures, failure_file)
@@ -0,0 +1,50 @@
+import os
+import pandas as pd
+from utils_pycorn import FEATURE_CURVES, load_run, get_features_from_run
+from parallel_extract import stage, extract_files, save_failures
+
+folder = '/home/kelidan/VVIRAL/data_dump/BTEC_Ufol/Gene Therapy Results'
+output_file = 'outputs/collation_10_07_24/all_btec_gene_affinity_data_direct.csv'
+failure_file = 'outputs/collation_10_07_24/all_btec_gene_affinity_data_direct_failures.csv'
+workers = os.cpu_count()
+
+
+def unicorn_rows(run):
+    """
+    This function takes in the path of a UNICORN export and returns the feature rows of its chromatograms.
+    Args:
+        run: path of the .zip/.Result file
+    Returns:
+        rows: list of dictionaries with the columns of the collated table, one per chromatogram
+    Raises:
+        StageError: tagged with the stage (read, features) that failed
+    """
+    with stage('read'):
+        fdata = load_run(run, FEATURE_CURVES)
+    with stage('features'):
+        rows = get_features_from_run(fdata, run)
+    for row in rows:
+        row['path'] = os.path.relpath(run, folder)
+    return rows
+
+
+if __name__ == '__main__':
+    all_runs = []
+    for root, dirs, files in os.walk(f"{folder}"):
+        for file in files:
+            if file.lower().endswith((".zip", ".result")):
+                all_runs.append(os.path.join(root, file))
+
+    rows = {}
+    failures = []
+    for run, run_rows, failure in extract_files(all_runs, unicorn_rows, workers):
+        if failure is not None:
+            print(failure['exception'], failure['message'], run)
+            failures.append(failure)
+            continue
+        rows[run] = run_rows
+
+    data = pd.DataFrame([row for run in all_runs if run in rows for row in rows[run]])
+
+    data.to_csv(output_file, index=False)
+    save_failures(failures, failure_file)
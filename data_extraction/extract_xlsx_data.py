@@ -1,70 +1,72 @@
 import os
 import pandas as pd
 from utils_xlsx import *
+from run_cache import read_excel_cached
+from manifest import load_manifest, save_manifest, changed_files, update_manifest, merge_table, feature_table
+from parallel_extract import stage, extract_files, save_failures
 
 folder = '/home/kelidan/VVIRAL/data_dump/BTEC_Ufol/Gene Therapy Results'
 folder_name = folder.split('/')[-1]
+output_file = 'outputs/collation_10_07_24/all_btec_gene_affinity_data.csv'
+manifest_file = 'outputs/collation_10_07_24/all_btec_gene_affinity_data_manifest.csv'
+failure_file = 'outputs/collation_10_07_24/all_btec_gene_affinity_data_failures.csv'
+workers = os.cpu_count()
+# bump to re-extract every file after a change of the feature code
+EXTRACTION_VERSION = 5
 
-all_csvs = []
-for root, dirs, files in os.walk(f"{folder}"):
-    for file in files:
-        if file.endswith(".xlsx"):
-            all_csvs.append(os.path.join(root, file))
+columns = ['resin', 'serotype', 'file', 'path', 'Pure', 'Blank',
+           'Elution pH', 'Wash pH', 'Equlibration pH', 'Elution Conductivity',
+           'Wash Conductivity', 'Equilibration Conductivity', 'Sample Volume (mL)',
+           'System Flowrate Elution (CV/h)', 'Sample Flowrate Elution (CV/h)', 'ChromID', 'Column Volume (mL)',
+           'Retention Time (min)', 'Sample flowrate (CV/h)']
 
-frame = {'resin': [], 'serotype': [], 'file': [], 'Pure':[], 'Blank':[],
-         'Elution pH': [],'Wash pH': [],'Equlibration pH': [],'Elution Conductivity': [],
-         'Wash Conductivity': [],'Equilibration Conductivity': [], 'Sample Volume (mL)':[],
-         'System Flowrate Elution (CV/h)': [], 'Sample Flowrate Elution (CV/h)': [], 'ChromID': [], 'Column Volume (mL)': [], 
-         'Retention Time (min)': [], 'Sample flowrate (CV/h)': []}
-for csv in all_csvs:
-    name = csv.split('/')[-1][:-5]
-    resin, serotype = get_resin_and_serotype(name)
-    if serotype == 'U':
-        serotype = csv.split('/')[-2]
-    pure = is_pure(name)
-    # col_vol = get_column_volume(name)
-    blank = is_blank(name)
-    # print(csv)
-    try:
-        df = pd.read_excel(csv,skiprows = [0])
+
+def xlsx_row(csv):
+    """
+    This function takes in the path of an xlsx written by pycorn-bin.py and returns its row of the collated table.
+    Args:
+        csv: path of the xlsx file
+    Returns:
+        row: dictionary with the columns of the collated table followed by the per-phase features
+    Raises:
+        StageError: tagged with the stage (metadata, read, schema, features) that failed
+    """
+    with stage('metadata'):
+        name = csv.split('/')[-1][:-5]
+        info = get_file_info(csv, name)
+        info['path'] = os.path.relpath(csv, folder)
+    with stage('read'):
+        df = read_excel_cached(csv)
+    with stage('schema'):
         data_dict = load_useful_data(df)
-    except Exception as e:
-        print(e, csv)
+    with stage('features'):
+        return {**info, **get_run_features(df, data_dict, all_phases=True, phase_stats=True)}
+
+
+if __name__ == '__main__':
+    all_csvs = []
+    for root, dirs, files in os.walk(f"{folder}"):
+        for file in files:
+            if file.endswith(".xlsx"):
+                all_csvs.append(os.path.join(root, file))
 
-    try:
-        elution_ph, elution_cond = get_ph_and_cond_at_elution(df, data_dict)
-        wash_ph, wash_cond = get_ph_and_cond_at_wash(df, data_dict)
-        sample_flow, system_flow = get_sample_and_sytem_flow_rate_at_elution(df, data_dict)
-        equilibration_ph, equilibration_cond = get_ph_and_cond_at_equilibration(df, data_dict)
-        sample_volume = get_sample_volume(df, data_dict)
-        chrom_id = get_chrom_id(df, data_dict)
-        column_volume = get_column_volume_xlsx(df, data_dict)
+    manifest = load_manifest(manifest_file)
+    all_csvs = changed_files(all_csvs, manifest, EXTRACTION_VERSION)
 
-        if column_volume == None or sample_flow == None:
-            retention_time = None
-        else:
-            retention_time = column_volume / (sample_flow/120)
-        frame['resin'].append(resin)
-        frame['serotype'].append(serotype)
-        frame['file'].append(name)
-        frame['Pure'].append(pure)
-        frame['Blank'].append(blank)
-        frame['Column Volume (mL)'].append(column_volume)
-        frame['Elution pH'].append(elution_ph)
-        frame['Wash pH'].append(wash_ph)
-        frame['Equlibration pH'].append(equilibration_ph)
-        frame['Elution Conductivity'].append(elution_cond)
-        frame['Wash Conductivity'].append(wash_cond)
-        frame['Equilibration Conductivity'].append(equilibration_cond)
-        frame['Sample Volume (mL)'].append(sample_volume)
-        frame['System Flowrate Elution (CV/h)'].append(system_flow)
-        frame['Sample Flowrate Elution (CV/h)'].append(sample_flow)
-        frame['ChromID'].append(chrom_id)
-        frame['Sample flowrate (CV/h)'].append(sample_flow)
-        frame['Retention Time (min)'].append(retention_time)
-    except Exception as e:
-        print(e, csv)
+    rows = {}
+    failures = []
+    for csv, row, failure in extract_files(all_csvs, xlsx_row, workers):
+        if failure is not None:
+            print(failure['exception'], failure['message'], csv)
+            failures.append(failure)
+            continue
+        rows[csv] = row
+        update_manifest(manifest, csv, EXTRACTION_VERSION, row['ChromID'])
 
-data = pd.DataFrame(frame)
+    data = feature_table([rows[csv] for csv in all_csvs if csv in rows], columns)
+    # rows of a file that failed are kept until it is extracted again
+    data = merge_table(output_file, data, [rows[csv]['path'] for csv in rows])
 
-data.to_csv(f'outputs/collation_10_07_24/all_btec_gene_affinity_data.csv', index=False)
\ No newline at end of file
+    data.to_csv(output_file, index=False)
+    save_manifest(manifest, manifest_file)
+    save_failures(failures, failure_file)
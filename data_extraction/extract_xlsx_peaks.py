@@ -1,82 +1,168 @@
 import os
+import xml.etree.ElementTree as ET
 from zipfile import ZipFile
 import pandas as pd
-import xmltodict
+from manifest import load_manifest, save_manifest, changed_files, update_manifest, merge_table
+from parallel_extract import stage, extract_files, save_failures
+from file_names import CHROM_XML, natural_key
 
 folder = '/home/kelidan/VVIRAL/data_dump/BTEC_Ufol/Gene Therapy Results'
-ZIPS = []
-for root, dirs, files in os.walk(f"{folder}"):
-    for file in files:
-        if file.endswith(".Result"):
-            ZIPS.append(os.path.join(root, file))
-print(len(ZIPS))
+workers = os.cpu_count()
+manifest_file = 'outputs/peak_data_manifest.csv'
+failure_file = 'outputs/peak_data_failures.csv'
+# bump to re-extract every file after a change of the extraction code
+EXTRACTION_VERSION = 3
 
 
-def zip2dict(inp):
+def element_to_dict(elem):
     """
-    input = zip object
-    outout = dict with filename:file-object pairs
+    input = xml element
+    output = dict in the layout of xmltodict (attributes as @name, repeated tags as lists)
     """
-    mydict = {}
-    for i in inp.NameToInfo:
-        tmp_dict = {i: inp.read(i)}
-        mydict.update(tmp_dict)
+    mydict = {f'@{k}': v for k, v in elem.attrib.items()}
+    for child in elem:
+        value = element_to_dict(child) if len(child) or child.attrib else child.text
+        if child.tag in mydict:
+            if type(mydict[child.tag]) != list:
+                mydict[child.tag] = [mydict[child.tag]]
+            mydict[child.tag].append(value)
+        else:
+            mydict[child.tag] = value
+    if mydict and elem.text and elem.text.strip():
+        mydict['#text'] = elem.text
     return mydict
 
-col_names = ['StartPeakLimitType', 'EndPeakLimitType', 'Name', 'Width', 'Area', 'Height', 
-             'StartPeakRetention', 'MaxPeakRetention', 'EndPeakRetention', 'WidthAtHalfHeight',
-             'PercentOfTotalArea', 'PercentOfTotalPeakArea', 'StartPeakEndpointHeight', 
-             'EndPeakEndpointHeight', 'StartBaseLineHeight', 'MaxBaseLineHeight', 'EndBaseLineHeight', 
-             'StartPeakVial', 'MaxPeakVial', 'EndPeakVial', 'Sigma', 'Assymetry', 'AssymetryPeakStart', 
-             'AssymetryPeakEnd', 'StartConductivityHeight', 'MaxConductivityHeight', 'EndConductivityHeight', 
-             'AverageConductivity', 'IsStandardPeak', 'file']
-
-df_data = [[], [], []]
-
-
-for i in ZIPS:
-    try:
-        with open(i, 'rb') as f:
-            input_zip = ZipFile(f)
-            zip_data = zip2dict(input_zip)
-            xml_read = xmltodict.parse(zip_data['Chrom.1.Xml'])
-    except:
-        xml_read = None
-
-    try:
-        data = xml_read['Chromatogram']['PeakTables']['PeakTable']['Peaks']['Peak']
-    except:
-        data = None
-
-    try:
-        events = xml_read['Chromatogram']['EventCurves']['EventCurve'][2]['Events']['Event']
-        
-        for event in range(len(events)):
-            if "Phase Elution" in events[event]['EventText']:
-                elution_start = float(events[event]['EventVolume'])
-                col_volume = float(xml_read['Chromatogram']['EventCurves']['EventCurve'][2]['ColumnVolume'])
-    except:
+
+def read_chrom_xml(path, event_curve=2):
+    """
+    input = path of a .Result archive
+    output = one (ChromID, peaks, events, column volume) tuple per chromatogram (Chrom.1.Xml, Chrom.2.Xml, ...
+             in natural order), see parse_chrom_xml
+    """
+    with ZipFile(path) as input_zip:
+        xml_names = sorted((n for n in input_zip.namelist() if CHROM_XML.search(n)), key=natural_key)
+        if len(xml_names) == 0:
+            raise KeyError(f'No chromatogram found in {path}')
+        chroms = []
+        for xml_name in xml_names:
+            with input_zip.open(xml_name) as f:
+                chroms.append(parse_chrom_xml(f, event_curve))
+    return chroms
+
+
+def parse_chrom_xml(f, event_curve=2):
+    """
+    input = open Chrom.N.Xml member of a .Result archive
+    output = ChromID, peaks of the first peak table, (text, volume) events and column volume of the
+             selected event curve, read incrementally (curves are skipped)
+    """
+    chrom_id = None
+    col_volume = None
+    peaks = []
+    events = []
+    tags = []
+    n_event_curves = 0
+    n_peak_tables = 0
+    for action, elem in ET.iterparse(f, events=('start', 'end')):
+        if action == 'start':
+            tags.append(elem.tag)
+            continue
+        tags.pop()
+        parent = tags[-1] if tags else None
+        if elem.tag == 'ChromatogramID' and parent == 'Chromatogram':
+            chrom_id = elem.text
+        elif elem.tag == 'EventCurve':
+            n_event_curves += 1
+            elem.clear()
+        elif n_event_curves == event_curve and parent == 'EventCurve' and elem.tag == 'ColumnVolume':
+            col_volume = float(elem.text)
+        elif n_event_curves == event_curve and elem.tag == 'Event' and 'EventCurve' in tags:
+            events.append((elem.findtext('EventText'), float(elem.findtext('EventVolume'))))
+        elif elem.tag == 'Peak' and parent == 'Peaks' and n_peak_tables == 0:
+            peaks.append(element_to_dict(elem))
+        elif elem.tag == 'PeakTable':
+            n_peak_tables += 1
+            elem.clear()
+        elif elem.tag == 'Curve':
+            elem.clear()
+    return chrom_id, peaks, events, col_volume
+
+
+def peak_rows(path):
+    """
+    input = path of a .Result archive
+    output = list with one (ChromID, list of peak dicts) pair per chromatogram (max. 3 peaks per chromatogram,
+             none if it has more), a file that can not be read raises a StageError
+    """
+    with stage('read'):
+        chroms = read_chrom_xml(path)
+
+    rows = []
+    for chrom_id, peaks, events, col_volume in chroms:
         elution_start = None
-        col_volume = None
+        for text, volume in events:
+            if text and "Phase Elution" in text:
+                elution_start = volume
+        if elution_start is None:
+            col_volume = None
+
+        if len(peaks) > 3:
+            peaks = []
+        for peak in peaks:
+            peak['file'] = path.split('/')[-1][:-7]
+            peak['path'] = os.path.relpath(path, folder)
+            peak['ChromID'] = chrom_id
+            peak['elution_start'] = elution_start
+            peak['Column Volume (mL)'] = col_volume
+        rows.append((chrom_id, peaks))
+    return rows
+
+
+col_names = ['StartPeakLimitType', 'EndPeakLimitType', 'Name', 'Width', 'Area', 'Height',
+             'StartPeakRetention', 'MaxPeakRetention', 'EndPeakRetention', 'WidthAtHalfHeight',
+             'PercentOfTotalArea', 'PercentOfTotalPeakArea', 'StartPeakEndpointHeight',
+             'EndPeakEndpointHeight', 'StartBaseLineHeight', 'MaxBaseLineHeight', 'EndBaseLineHeight',
+             'StartPeakVial', 'MaxPeakVial', 'EndPeakVial', 'Sigma', 'Assymetry', 'AssymetryPeakStart',
+             'AssymetryPeakEnd', 'StartConductivityHeight', 'MaxConductivityHeight', 'EndConductivityHeight',
+             'AverageConductivity', 'IsStandardPeak', 'file', 'path']
+
+
+if __name__ == '__main__':
+    ZIPS = []
+    for root, dirs, files in os.walk(f"{folder}"):
+        for file in files:
+            if file.endswith(".Result"):
+                ZIPS.append(os.path.join(root, file))
+    manifest = load_manifest(manifest_file)
+    ZIPS = changed_files(ZIPS, manifest, EXTRACTION_VERSION)
+    print(len(ZIPS))
 
-    if data:
-        peaks = xml_read['Chromatogram']['PeakTables']['PeakTable']['Peaks']['Peak']
-        if type(peaks) != list:
-            peaks = [peaks]
-        if len(peaks) <= 3:
+    results = {}
+    failures = []
+    for path, chroms, failure in extract_files(ZIPS, peak_rows, workers):
+        if failure is not None:
+            print(failure['exception'], failure['message'], path)
+            failures.append(failure)
+        else:
+            results[path] = chroms
+
+    # the tables and the manifest are written in walk order
+    df_data = [[], [], []]
+    processed = []
+    for path in ZIPS:
+        if path not in results:
+            continue
+        for chrom_id, peaks in results[path]:
             for j in range(len(peaks)):
-                if len(peaks) != 0:
-                    peaks[j]['file'] = i.split('/')[-1][:-7]
-                    peaks[j]['ChromID'] = xml_read['Chromatogram']['ChromatogramID']
-                    peaks[j]['elution_start'] = elution_start
-                    peaks[j]['Column Volume (mL)'] = col_volume
-                    df_data[j].append(peaks[j])
-    
-        
-df1 = pd.DataFrame(df_data[0])
-df2 = pd.DataFrame(df_data[1])
-df3 = pd.DataFrame(df_data[2])
-
-df1.to_csv('outputs/peak_data1.csv', index=False)
-df2.to_csv('outputs/peak_data2.csv', index=False)
-df3.to_csv('outputs/peak_data3.csv', index=False)
\ No newline at end of file
+                df_data[j].append(peaks[j])
+        chrom_ids = [chrom_id for chrom_id, peaks in results[path] if chrom_id is not None]
+        update_manifest(manifest, path, EXTRACTION_VERSION, ';'.join(chrom_ids) or None)
+        processed.append(os.path.relpath(path, folder))
+
+    # rows of a file that failed are kept until it is extracted again
+    for j in range(3):
+        table_file = f'outputs/peak_data{j + 1}.csv'
+        df = merge_table(table_file, pd.DataFrame(df_data[j]), processed)
+        df.to_csv(table_file, index=False)
+    save_manifest(manifest, manifest_file)
+    save_failures(failures, failure_file)
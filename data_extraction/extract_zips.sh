@@ -12,9 +12,8 @@
 
 dir="data_dump/New Data Collection 040424 BTEC_annex/all"
 
-# Loop over all zip files in the directory and its subdirectories
-find "$dir" -name "*.zip" | while read i; do
-    # Run the command on each zip file
-    python3 pycorn-bin.py -e xlsx "$i"
-    # python pycorn-bin.py -t "$i"
-done
\ No newline at end of file
+# Convert all zip files in the directory and its subdirectories in one
+# interpreter, one worker per core. The pattern is quoted so pycorn-bin.py
+# expands it itself; passing "$dir" would also pick up .Result/.res files
+python3 pycorn-bin.py -e xlsx -w "$(nproc)" "$dir/**/*.zip"
+# python pycorn-bin.py -t "$dir/**/*.zip"
@@ -0,0 +1,58 @@
+import re
+from collections import namedtuple
+from functools import lru_cache
+import pandas as pd
+
+# attribute patterns, every one matched at its first occurrence in the name like re.findall(...)[0]
+NAME_FIELDS = (('resin', r'AAV[A-Z]\d+'), ('resin_x', r'AAV[xX]'), ('resin_a10', r'[aA]10'),
+               ('serotype', r'AAV*\d+'), ('column_volume', r'\d+(?:\.\d+)?[mM][lL]'),
+               ('pure', r'[pP]ure'), ('blank', r'[bB]lank'))
+# one optional lookahead per attribute, so a single match call fills every group
+NAME_PATTERN = re.compile('^' + ''.join(f'(?=(?:.*?(?P<{field}>{pattern}))?)' for field, pattern in NAME_FIELDS),
+                          re.DOTALL)
+
+# chromatograms of an export: 'Chrom.1', 'Chrom.2', ... or '<run name>/Chrom.1' for multi-run exports
+CHROM_KEY = re.compile(r'(^|/)Chrom\.\d+$')
+CHROM_XML = re.compile(r'(^|/)Chrom\.\d+\.Xml$')
+
+FileName = namedtuple('FileName', ['resin', 'serotype', 'column_volume', 'pure', 'blank'])
+
+
+@lru_cache(maxsize=None)
+def parse_file_name(name):
+    """
+    This function takes in the name of a run file and returns every attribute encoded in it.
+    Args:
+        name: name of the file
+    Returns:
+        FileName record with resin (AAV<letter><digits>, else AAVX, else A10), serotype, column volume
+        (e.g. '1mL'), None for attributes not in the name, and pure and blank flags
+    """
+    groups = NAME_PATTERN.match(name).groupdict()
+    resin = groups['resin'] or groups['resin_x'] or groups['resin_a10']
+    return FileName(resin, groups['serotype'], groups['column_volume'], groups['pure'] is not None,
+                    groups['blank'] is not None)
+
+def parse_file_names(names):
+    """
+    This function takes in a list of run file names and returns their attributes as a dataframe,
+    with one vectorized str.extract over the whole list.
+    Args:
+        names: list or series of file names
+    Returns:
+        data: dataframe with the columns of FileName, one row per name
+    """
+    groups = pd.Series(names, dtype=object).str.extract(NAME_PATTERN)
+    return pd.DataFrame({'resin': groups['resin'].fillna(groups['resin_x']).fillna(groups['resin_a10']),
+                         'serotype': groups['serotype'], 'column_volume': groups['column_volume'],
+                         'pure': groups['pure'].notna(), 'blank': groups['blank'].notna()})
+
+def natural_key(name):
+    """
+    This function takes in a name and returns a key that sorts embedded numbers numerically (Chrom.2 < Chrom.10).
+    Args:
+        name: string
+    Returns:
+        key: list of strings and integers
+    """
+    return [int(t) if t.isdigit() else t for t in re.split(r'(\d+)', name)]
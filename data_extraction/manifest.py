@@ -0,0 +1,128 @@
+import os
+import pandas as pd
+from run_cache import file_digest
+
+# mtime_ns is the integer st_mtime_ns, a float mtime does not always survive the round trip through the csv
+MANIFEST_COLUMNS = ['path', 'size', 'mtime_ns', 'sha1', 'ChromID', 'version']
+
+
+def load_manifest(manifest_file):
+    """
+    This function takes in the path of a manifest csv and returns the manifest.
+    Args:
+        manifest_file: path of the manifest csv (does not need to exist)
+    Returns:
+        manifest: dataframe with one row per ingested file, indexed by path
+    """
+    if os.path.exists(manifest_file):
+        manifest = pd.read_csv(manifest_file, dtype={'sha1': str, 'ChromID': object, 'version': str})
+        # manifests written before mtime_ns have no such column, their files are checked by hash once
+        manifest = manifest.reindex(columns=MANIFEST_COLUMNS)
+    else:
+        manifest = pd.DataFrame(columns=MANIFEST_COLUMNS)
+    manifest['mtime_ns'] = manifest['mtime_ns'].astype('Int64')
+    return manifest.set_index('path', drop=False)
+
+def save_manifest(manifest, manifest_file):
+    """
+    This function takes in a manifest and writes it to a csv.
+    Args:
+        manifest: dataframe returned by load_manifest
+        manifest_file: path of the manifest csv
+    Returns:
+        None
+    """
+    manifest[MANIFEST_COLUMNS].to_csv(manifest_file, index=False)
+
+def is_unchanged(manifest, path, version):
+    """
+    This function takes in a manifest, a file and the extraction version and returns True if the file
+    was already ingested with this version. Size and mtime are checked first, the content hash only
+    when the mtime changed (e.g. after a copy).
+    Args:
+        manifest: dataframe returned by load_manifest
+        path: path of the file
+        version: version of the extraction code
+    Returns:
+        True if the file does not need to be processed again, False otherwise
+    """
+    if path not in manifest.index:
+        return False
+    entry = manifest.loc[path]
+    stat = os.stat(path)
+    if str(entry['version']) != str(version) or int(entry['size']) != stat.st_size:
+        return False
+    if not pd.isna(entry['mtime_ns']) and int(entry['mtime_ns']) == stat.st_mtime_ns:
+        return True
+    if file_digest(path) == entry['sha1']:
+        manifest.loc[path, 'mtime_ns'] = stat.st_mtime_ns
+        return True
+    return False
+
+def changed_files(files, manifest, version):
+    """
+    This function takes in a list of files and a manifest and returns the files that are new or changed.
+    Args:
+        files: list of paths
+        manifest: dataframe returned by load_manifest
+        version: version of the extraction code
+    Returns:
+        changed: list of paths that have to be processed
+    """
+    return [f for f in files if not is_unchanged(manifest, f, version)]
+
+def update_manifest(manifest, path, version, chrom_id=None):
+    """
+    This function takes in a manifest and records a processed file in it.
+    Args:
+        manifest: dataframe returned by load_manifest
+        path: path of the file
+        version: version of the extraction code
+        chrom_id: chromatography id of the run, if known (the ids of a multi-run archive joined with ';')
+    Returns:
+        None
+    """
+    stat = os.stat(path)
+    manifest.loc[path, MANIFEST_COLUMNS] = [path, stat.st_size, stat.st_mtime_ns, file_digest(path), chrom_id,
+                                            str(version)]
+
+def feature_table(rows, columns):
+    """
+    This function takes in feature rows and the fixed columns of a table and returns the table, the fixed
+    columns first and every further column (e.g. the per-phase features, which differ between runs) after them.
+    Args:
+        rows: list of dictionaries
+        columns: fixed columns of the table
+    Returns:
+        data: dataframe
+    """
+    data = pd.DataFrame(rows)
+    return data.reindex(columns=list(columns) + [col for col in data.columns if col not in columns])
+
+def merge_table(table_file, new_data, replaced, key='path'):
+    """
+    This function takes in an existing feature table and new rows and returns the merged table.
+    Rows of the old table whose key is in replaced are dropped, the new rows are appended.
+    The key is the relative path of the source file, file names repeat across folders.
+    An old table without the key column is from an older layout and is dropped as a whole.
+    Args:
+        table_file: path of the existing feature table csv (does not need to exist)
+        new_data: dataframe with the new rows
+        replaced: list of keys that were processed again
+        key: name of the key column
+    Returns:
+        data: merged dataframe
+    """
+    if not os.path.exists(table_file):
+        return new_data
+    try:
+        old_data = pd.read_csv(table_file)
+    except pd.errors.EmptyDataError:
+        return new_data
+    if key not in old_data:
+        return new_data
+    new_keys = set(new_data[key]) if key in new_data else set()
+    old_data = old_data[~old_data[key].isin(set(replaced) | new_keys)]
+    if len(new_data) == 0:
+        return old_data.reset_index(drop=True)
+    return pd.concat([old_data, new_data], ignore_index=True)
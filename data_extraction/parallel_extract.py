@@ -0,0 +1,83 @@
+import os
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+
+FAILURE_COLUMNS = ['file', 'stage', 'exception', 'message']
+
+
+class StageError(Exception):
+    """
+    This exception wraps the exception raised in one stage (read, schema, features, ...) of a file.
+    Args:
+        stage: name of the stage
+        error: exception raised in the stage
+    """
+    def __init__(self, stage, error):
+        super().__init__(stage, error)
+        self.stage = stage
+        self.error = error
+
+@contextmanager
+def stage(name):
+    """
+    This function takes in the name of a stage and tags every exception raised inside the with-block with it.
+    Args:
+        name: name of the stage
+    Returns:
+        context manager
+    """
+    try:
+        yield
+    except StageError:
+        raise
+    except Exception as e:
+        raise StageError(name, e) from e
+
+def failure_record(path, error):
+    """
+    This function takes in a file and the exception its extraction raised and returns a row of the failure table.
+    Args:
+        path: path of the file
+        error: exception (a StageError or any other exception)
+    Returns:
+        failure: dictionary with file, stage, exception and message
+    """
+    stage_name = error.stage if isinstance(error, StageError) else 'extract'
+    error = error.error if isinstance(error, StageError) else error
+    return {'file': path, 'stage': stage_name, 'exception': type(error).__name__, 'message': str(error)}
+
+def _safe_call(worker, path):
+    try:
+        return worker(path), None
+    except Exception as e:
+        return None, failure_record(path, e)
+
+def extract_files(files, worker, workers=None):
+    """
+    This function takes in a list of files and a per-file worker and runs the worker on a process pool.
+    The worker runs on every file on its own, so a file that fails can not leak into the next one.
+    Args:
+        files: list of paths
+        worker: module level function that takes in a path and returns the extracted result
+        workers: number of processes (default: number of cpus)
+    Returns:
+        generator of (path, result, failure) tuples in the order the workers finish,
+        result is None if the file failed and failure is None if it did not
+    """
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = {pool.submit(_safe_call, worker, path): path for path in files}
+        for future in as_completed(futures):
+            result, failure = future.result()
+            yield futures[future], result, failure
+
+def save_failures(failures, failure_file):
+    """
+    This function takes in a list of failure records and writes them to a csv.
+    Args:
+        failures: list of dictionaries returned by failure_record
+        failure_file: path of the csv
+    Returns:
+        None
+    """
+    pd.DataFrame(failures, columns=FAILURE_COLUMNS).to_csv(failure_file, index=False)
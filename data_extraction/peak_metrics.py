@@ -1,93 +1,140 @@
-import math
 import numpy as np
+from scipy.signal import peak_widths, peak_prominences
+from curve_ops import index_to_volume, CurveIntegral
 
-def tailing_factor(peaks, results):
-    res = []
-    for i in range(len(peaks)):
-        a = peaks[i] - results[1][i]
-        b = results[2][i] - peaks[i]
-        Tf = (a+b) / (2*a)
-        res.append(Tf)
+def batch_offsets(lengths, n_peaks):
+    """
+    Returns the offset of every peak of a batch of runs into their concatenated volume array
+    Args:
+    lengths: list of integers, number of points of every run
+    n_peaks: list of integers, number of peaks of every run
+
+    Returns:
+    offsets: array of integers, one per peak (pass as offsets= to the metrics)
+    """
+    run_offsets = np.append(0, np.cumsum(lengths)[:-1]).astype(int)
+    return np.repeat(run_offsets, n_peaks)
+
+def peak_widths_at(x, peaks, rel_heights, prominence_data=None):
+    """
+    Returns the widths of the peaks at several relative heights, with one prominence calculation
+    Args:
+    x: array of floats, signal
+    peaks: array of integers
+    rel_heights: list of floats, e.g. [0.5, 1, 0.95, 0.9]
+    prominence_data: prominences, left and right bases of the peaks (e.g. from the info of find_peaks),
+                     computed with peak_prominences if None
+
+    Returns:
+    res: array of floats with shape (len(rel_heights), 4, len(peaks)), res[k] holds widths, width heights,
+         left and right interpolated positions at rel_heights[k] like peak_widths (res[k][1:] for the metrics)
+    """
+    x = np.asarray(x, dtype=float)
+    if prominence_data is None:
+        prominence_data = peak_prominences(x, peaks)
+    res = np.empty((len(rel_heights), 4, len(peaks)))
+    for k, rel_height in enumerate(rel_heights):
+        res[k] = peak_widths(x, peaks, rel_height=rel_height, prominence_data=prominence_data)
     return res
 
+def tailing_factor(peaks, results):
+    """
+    Returns the tailing factor of the peaks
+    Args:
+    peaks: array of integers (flat peaks of one run or a batch of runs)
+    results: width heights, left and right interpolated positions of peak_widths (rel_height=0.95)
+
+    Returns:
+    res: array of floats
+    """
+    peaks = np.asarray(peaks, dtype=float)
+    a = peaks - np.asarray(results[1], dtype=float)
+    b = np.asarray(results[2], dtype=float) - peaks
+    return (a + b) / (2*a)
+
 def peak_assymetry(peaks, results):
-    res = []
-    for i in range(len(peaks)):
-        a = peaks[i] - results[1][i]
-        b = results[2][i] - peaks[i]
-        res.append(b/a)
-    return res
+    """
+    Returns the assymetry of the peaks
+    Args:
+    peaks: array of integers (flat peaks of one run or a batch of runs)
+    results: width heights, left and right interpolated positions of peak_widths (rel_height=0.9)
 
-def number_of_theoretical_plates(volume, peaks, results):
-    res = []
-    for i in range(len(peaks)):
-        retention_volume = volume[peaks[i]]
-        #width = results[i]
-        width = volume[round(results[2][i])] - volume[round(results[1][i])]
-        N = 5.54 * (retention_volume/width)**2
-        res.append(N)
-    return res
+    Returns:
+    res: array of floats
+    """
+    peaks = np.asarray(peaks, dtype=float)
+    a = peaks - np.asarray(results[1], dtype=float)
+    b = np.asarray(results[2], dtype=float) - peaks
+    return b / a
 
-def area(volume, peaks, results, height):
-    res = []
-    n_plates = number_of_theoretical_plates(volume, peaks, results)
-    for i in range(len(peaks)):
-        retention_volume = volume[peaks[i]]
-        H = height[i]
-        N = n_plates[i]
-        denominator = math.sqrt(N / (2*math.pi))
-        # print(data['ml'][peaks[i]])
-        area = (retention_volume * H) / denominator
-        res.append(area)
-    return res
+def number_of_theoretical_plates(volume, peaks, results, offsets=0):
+    """
+    Returns the number of theoretical plates of the peaks
+    Args:
+    volume: array of floats (concatenated volumes for a batch of runs)
+    peaks: array of integers
+    results: width heights, left and right interpolated positions of peak_widths
+    offsets: integer or array of integers, position of every peak's run in volume (see batch_offsets)
 
-def peak_height(peaks, height):
+    Returns:
+    res: array of floats
     """
-    Returns the height of the peaks
+    volume = np.asarray(volume, dtype=float)
+    retention_volume = volume[np.asarray(peaks, dtype=int) + offsets]
+    # the width ends are interpolated between samples instead of rounded to the nearest one
+    left = index_to_volume(volume, np.asarray(results[1], dtype=float) + offsets)
+    right = index_to_volume(volume, np.asarray(results[2], dtype=float) + offsets)
+    width = right - left
+    return 5.54 * (retention_volume/width)**2
+
+def area(volume, peaks, results, height, n_plates=None, offsets=0):
+    """
+    Returns the area of the peaks (gaussian approximation)
     Args:
-    peaks: list of integers
-    height: list of floats
-    
+    volume: array of floats (concatenated volumes for a batch of runs)
+    peaks: array of integers
+    results: width heights, left and right interpolated positions of peak_widths
+    height: array of floats
+    n_plates: array of floats, number of theoretical plates (computed from results if None)
+    offsets: integer or array of integers, position of every peak's run in volume (see batch_offsets)
+
     Returns:
-    res: list of floats
+    res: array of floats
     """
-    res = []
-    for i in range(len(peaks)):
-        res.append(height[i])
-    return res
+    if n_plates is None:
+        n_plates = number_of_theoretical_plates(volume, peaks, results, offsets)
+    retention_volume = np.asarray(volume, dtype=float)[np.asarray(peaks, dtype=int) + offsets]
+    denominator = np.sqrt(np.asarray(n_plates, dtype=float) / (2*np.pi))
+    return (retention_volume * np.asarray(height, dtype=float)) / denominator
 
-def integrate_peak(peaks, info, data):
+def integrated_area(volume, uv, results, offsets=0, integral=None):
     """
-    Returns the integrated area of the peaks
+    Returns the area of the peaks integrated over the volume axis (trapezoid, between the interpolated
+    positions of the widths, rel_height=1 for base to base)
     Args:
-    peaks: list of integers
-    info: list of floats
-    
+    volume: array of floats (concatenated volumes for a batch of runs)
+    uv: array of floats (concatenated signals for a batch of runs)
+    results: width heights, left and right interpolated positions of peak_widths
+    offsets: integer or array of integers, position of every peak's run in volume (see batch_offsets)
+    integral: CurveIntegral of volume and uv, built here if None
+
     Returns:
-    res: list of floats
-    """
-    res = []
-    for i in range(len(peaks)):
-        lower = info['left_bases'][i]
-        upper = info['right_bases'][i]
-        integrated_area = np.trapz(data[lower:upper])
-        res.append(integrated_area)
-    return res
+    res: array of floats
+    """
+    if integral is None:
+        integral = CurveIntegral(volume, uv)
+    left = np.asarray(results[1], dtype=float) + offsets
+    right = np.asarray(results[2], dtype=float) + offsets
+    return integral.between_positions(left, right)
 
-def integrate_peak_2(peaks, info, data):
+def peak_height(peaks, height):
     """
-    Returns the integrated area of the peaks
+    Returns the height of the peaks
     Args:
-    peaks: list of integers
-    info: list of floats
+    peaks: array of integers
+    height: array of floats
     
     Returns:
-    res: list of floats
-    """
-    res = []
-    for i in range(len(peaks)):
-        lower = info['left_bases'][i]
-        upper = info['right_bases'][i]
-        integrated_area = np.trapezoid(data[lower:upper])
-        res.append(integrated_area)
-    return res
\ No newline at end of file
+    res: array of floats
+    """
+    return np.asarray(height, dtype=float)[:len(peaks)]
@@ -8,8 +8,18 @@ v0.18
 '''
 
 import argparse
+import glob
+import os
+import re
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from itertools import zip_longest
+
+import numpy as np
 
 from pycorn import PcUni6, PcRes3
+from utils_pycorn import xy_data, curves_to_arrays, load_curves, get_chroms, chrom_columns, get_injection_point, \
+    FEATURE_CURVES
 
 try:
     from mpl_toolkits.axes_grid1 import host_subplot
@@ -33,6 +43,7 @@ except:
     xlsx = False
 
 pcscript_version = 0.14
+supported_ext = ('.zip', '.result', '.res')
 
 parser = argparse.ArgumentParser(
     description="Extract data from UNICORN .res files to .csv/.txt and plot them (matplotlib required)",
@@ -43,6 +54,9 @@ parser.add_argument("-i", "--inject", type=int, default=None,
                     help="Set injection number # as zero retention, use -t to find injection points", metavar="#")
 parser.add_argument("-r", "--reduce", type=int, default=1, help="Write/Plot only every n sample", metavar="#")
 parser.add_argument("-t", "--points", help="Display injection points", action="store_true")
+parser.add_argument("--curves", type=str, default=None,
+                    help="Decode only these curves from .zip/.Result files (comma-separated name prefixes, "
+                         "'features' = curves used by the feature extraction)", metavar="<curves>")
 
 group0 = parser.add_argument_group('Extracting', 'Options for writing csv/txt files')
 group0.add_argument("-e", "--extract", type=str, choices=['csv', 'xlsx'],
@@ -62,11 +76,17 @@ group1.add_argument("--par2", type=str, default=None, help="Data for 3rd y-axis
 group1.add_argument('-f', '--format', type=str,
                     choices=['svg', 'svgz', 'tif', 'tiff', 'jpg', 'jpeg', 'png', 'ps', 'eps', 'raw', 'rgba', 'pdf',
                              'pgf'], default='pdf', help="File format of plot files (default: pdf)")
+group1.add_argument("--max_points", type=int, default=None,
+                    help="Max. points drawn per curve (min/max per bin), default: plot width in pixels x2, 0 = all",
+                    metavar="#")
 group1.add_argument('-d', '--dpi', default=300, type=int,
                     help="DPI (dots per inch) for raster images (png, jpg, etc.). Default is 300.")
 parser.add_argument("-u", "--user", help="Show stored user name", action="store_true")
 parser.add_argument('--version', action='version', version=str(pcscript_version))
-parser.add_argument("inp_res", help="Input .res file(s)", nargs='+', metavar="<file>.res")
+parser.add_argument("-w", "--workers", type=int, default=1,
+                    help="Number of files converted in parallel (default: 1)", metavar="#")
+parser.add_argument("inp_res", help="Input .res/.zip/.Result file(s), directories or glob patterns", nargs='+',
+                    metavar="<file>.res")
 # args.no_inject
 args = parser.parse_args()
 
@@ -91,13 +111,38 @@ def expander(min_val, max_val, perc):
     return (min_val - x, max_val + x)
 
 
-def xy_data(inp):
+def nearest_idx(x_dat, val):
+    '''
+    index of the value closest to val in the sorted array x_dat (binary search)
+    '''
+    if len(x_dat) < 2:
+        return 0
+    idx = min(max(int(np.searchsorted(x_dat, val)), 1), len(x_dat) - 1)
+    if val - x_dat[idx - 1] <= x_dat[idx] - val:
+        return idx - 1
+    return idx
+
+
+def decimate(x_dat, y_dat, n_bins, x_min=None, x_max=None):
     '''
-    Takes a data block and returns two lists with x- and y-data
+    shape-preserving downsampling for plotting: restricts the data to
+    [x_min, x_max] and keeps the min and max point of each of n_bins bins
     '''
-    x_data = [x[0] for x in inp]
-    y_data = [x[1] for x in inp]
-    return x_data, y_data
+    x_dat, y_dat = np.asarray(x_dat), np.asarray(y_dat, dtype=float)
+    lo = 0 if x_min is None else max(int(np.searchsorted(x_dat, x_min)) - 1, 0)
+    hi = len(x_dat) if x_max is None else int(np.searchsorted(x_dat, x_max, side='right')) + 1
+    x_dat, y_dat = x_dat[lo:hi], y_dat[lo:hi]
+    if not n_bins or len(x_dat) <= 2 * n_bins:
+        return x_dat, y_dat
+    size = -(-len(y_dat) // n_bins)
+    pad = size * n_bins - len(y_dat)
+    y_nan = np.isnan(y_dat)
+    y_lo = np.pad(np.where(y_nan, np.inf, y_dat), (0, pad), constant_values=np.inf).reshape(n_bins, size)
+    y_hi = np.pad(np.where(y_nan, -np.inf, y_dat), (0, pad), constant_values=-np.inf).reshape(n_bins, size)
+    offsets = np.arange(n_bins) * size
+    keep = np.sort(np.stack([offsets + y_lo.argmin(axis=1), offsets + y_hi.argmax(axis=1)], axis=1), axis=1)
+    keep = np.minimum(keep.ravel(), len(y_dat) - 1)
+    return x_dat[keep], y_dat[keep]
 
 
 def uvdata(inp):
@@ -161,13 +206,12 @@ def smartscale(inp):
     max_y_values = []
     for i in UV_blocks:
         tmp_x, tmp_y = xy_data(inp[i]['data'])
-        range_min_lst = [abs(a - plot_x_min) for a in tmp_x]
-        range_min_idx = range_min_lst.index(min(range_min_lst))
-        range_max_lst = [abs(a - plot_x_max) for a in tmp_x]
-        range_max_idx = range_max_lst.index(min(range_max_lst))
+        tmp_x, tmp_y = np.asarray(tmp_x), np.asarray(tmp_y)
+        range_min_idx = nearest_idx(tmp_x, plot_x_min)
+        range_max_idx = nearest_idx(tmp_x, plot_x_max)
         values_in_range = tmp_y[range_min_idx:range_max_idx]
-        min_y_values.append(min(values_in_range))
-        max_y_values.append(max(values_in_range))
+        min_y_values.append(values_in_range.min())
+        max_y_values.append(values_in_range.max())
     plot_y_min_tmp = min(min_y_values)
     plot_y_max_tmp = max(max_y_values)
     plot_y_min, plot_y_max = expander(plot_y_min_tmp, plot_y_max_tmp, 0.085)
@@ -181,9 +225,14 @@ def plotterX(inp, fname):
     host.set_ylabel("Absorbance (mAu)")
     host.set_xlim(plot_x_min, plot_x_max)
     host.set_ylim(plot_y_min, plot_y_max)
+    if args.max_points is None:
+        n_bins = int(plt.gcf().get_figwidth() * args.dpi)
+    else:
+        n_bins = args.max_points // 2
     for i in inp.keys():
         if i.startswith('UV') and not i.endswith('_0nm'):
             x_dat, y_dat = xy_data(inp[i]['data'])
+            x_dat, y_dat = decimate(x_dat, y_dat, n_bins, plot_x_min, plot_x_max)
             print("Plotting: " + inp[i]['data_name'])
             stl = styles[i[:4]]
             p0, = host.plot(x_dat, y_dat, label=inp[i]['data_name'], color=stl['color'], ls=stl['ls'], lw=stl['lw'],
@@ -198,8 +247,9 @@ def plotterX(inp, fname):
             stl = styles[par1_inp[:4]]
             par1.set_ylabel(par1_data['data_name'] + " (" + par1_data['unit'] + ")", color=stl['color'])
             x_dat_p1, y_dat_p1 = xy_data(par1_data['data'])
-            p1_ymin, p1_ymax = expander(min(y_dat_p1), max(y_dat_p1), 0.085)
+            p1_ymin, p1_ymax = expander(np.min(y_dat_p1), np.max(y_dat_p1), 0.085)
             par1.set_ylim(p1_ymin, p1_ymax)
+            x_dat_p1, y_dat_p1 = decimate(x_dat_p1, y_dat_p1, n_bins, plot_x_min, plot_x_max)
             print("Plotting: " + par1_data['data_name'])
             p1, = par1.plot(x_dat_p1, y_dat_p1, label=par1_data['data_name'], color=stl['color'], ls=stl['ls'],
                             lw=stl['lw'], alpha=stl['alpha'])
@@ -219,8 +269,9 @@ def plotterX(inp, fname):
             stl = styles[par2_inp[:4]]
             par2.set_ylabel(par2_data['data_name'] + " (" + par2_data['unit'] + ")", color=stl['color'])
             x_dat_p2, y_dat_p2 = xy_data(par2_data['data'])
-            p2_ymin, p2_ymax = expander(min(y_dat_p2), max(y_dat_p2), 0.075)
+            p2_ymin, p2_ymax = expander(np.min(y_dat_p2), np.max(y_dat_p2), 0.075)
             par2.set_ylim(p2_ymin, p2_ymax)
+            x_dat_p2, y_dat_p2 = decimate(x_dat_p2, y_dat_p2, n_bins, plot_x_min, plot_x_max)
             print("Plotting: " + par2_data['data_name'])
             p2, = par2.plot(x_dat_p2, y_dat_p2, label=par2_data['data_name'], color=stl['color'], ls=stl['ls'],
                             lw=stl['lw'], alpha=stl['alpha'])
@@ -277,80 +328,52 @@ def data_writer1(fname, inp):
             x_dat, y_dat = xy_data(inp[i]['data'])
             ext = '.csv'
             sep = ','
+            lines = [str(x) + sep + str(y) + str('\r\n') for x, y in zip(list(x_dat), list(y_dat))]
             with open(outfile_base + ext, 'wb') as fout:
-                for x, y in zip(x_dat, y_dat):
-                    dp = str(x) + sep + str(y) + str('\r\n')
-                    data_to_write = dp.encode('utf-8')
-                    fout.write(data_to_write)
+                fout.write(''.join(lines).encode('utf-8'))
+
+
+def write_chrom_xls(chrom, xls_filename):
+    '''
+    Input = data blocks of one chromatogram
+    output = xlsx file, streamed row by row (constant memory)
+    '''
+    workbook = xlsxwriter.Workbook(xls_filename, {'constant_memory': True})
+    worksheet = workbook.add_worksheet()
+    inj_point = get_injection_point(chrom)
+    header1, header2, columns = [], [], []
+    for i in chrom.keys():
+        print("Writing: " + i)
+        for head1, head2, dat in chrom_columns(i, chrom[i], inj_point):
+            header1.append(head1)
+            header2.append(head2)
+            columns.append(dat)
+    worksheet.write_row(0, 0, header1)
+    worksheet.write_row(1, 0, header2)
+    # constant_memory mode flushes every finished row, so rows have to be
+    # written in order; missing cells (None) of shorter blocks are skipped
+    for row, values in enumerate(zip_longest(*columns), start=2):
+        worksheet.write_row(row, 0, values)
+    workbook.close()
+    print("Data written to: " + xls_filename)
 
 
 def generate_xls(inp, fname):
     '''
     Input = pycorn object
-    output = xlsx file
+    output = one xlsx file per chromatogram, named after the input file, every one
+    suffixed with its chromatogram name if the file holds more than one
     '''
     # xls_filename = fname[:-4] + "_" + inp._run_name + ".xlsx"
     # xls_filename = fname[:-4] + ".xlsx"
-    xls_filename = fname[:-7] + ".xlsx"
-    workbook = xlsxwriter.Workbook(xls_filename)
-    worksheet = workbook.add_worksheet()
-    
-    writable_blocks = [inp._fractions_id, inp._fractions_id2, inp._sens_data_id, inp._sens_data_id2]
-    # writable_blocks = [inp.Fractions_id, inp.Fractions_id2, inp.SensData_id, inp.SensData_id2]
-    d_list = []
-
-    print(inp.keys(), 1)
-    # print(inp['Chrom.1.Xml_dict'].keys(), 2)
-    # print(inp['Chrom.1'].keys(), 3)
-    # print(inp['Chrom.1']['UV 1_280'].keys(), 4)
-    # print(inp['Chrom.1']['UV 1_280']['data'][:5], 5)
-    # c = 'AAVA 8 SET 2 TOYOPEARL Lysate AAV Load Run SAS052722.3188'
-    # d_list = list(inp[f'{c}/Chrom.1'].keys())
-    d_list = list(inp['Chrom.1'].keys())
-    # print(d_list, "ll")
-    # for i in inp['Chrom.1'].keys():
-    #     if inp[i]['magic_id'] in writable_blocks:
-    #         d_list.append(i)
-    # for i in inp.keys():
-    #     if inp[i]['magic_id'] in writable_blocks:
-    #         d_list.append(i)
-    inj_point = inp[f'Chrom.1']['Injection']['data'][0][0]
-    inp = inp[f'Chrom.1']
-
-    # inj_point = inp[f'{c}/Chrom.1']['Injection']['data'][0][0]
-    # inp = inp[f'{c}/Chrom.1']
-
-    for i in d_list:
-        dat = inp[i]['data']
-        try:
-            unit = inp[i]['unit']
-        except:
-            KeyError
-            unit = 'Fraction'
-        header1 = (inp[i]['data_name'], '')
-        # if header1[0] == 'pH':
-        #      header2 = ('ml', 'pH')
-        # header2 = ('ml', unit)
-        if header1[0] == 'pH':
-             header2 = ('ml', 'pH')
+    chroms = get_chroms(inp)
+    base = os.path.splitext(fname)[0]
+    for key, chrom in chroms.items():
+        if len(chroms) == 1:
+            xls_filename = base + ".xlsx"
         else:
-            header2 = ('ml', unit)
-        dat.insert(0, header1)
-        dat.insert(1, header2)
-        row = 0
-        col = d_list.index(i) * 2
-        print("Writing: " + i)
-        if i == 'Injection':
-            dat.append((inp[i]['chrom_id'], "ChromID"))
-            dat.append((inp[i]['column_vol'], "ColumnVolume (ml)"))
-        for x_val, y_val in (dat):
-            if type(x_val) != str:
-                x_val = x_val - inj_point
-            worksheet.write(row, col, x_val)
-            worksheet.write(row, col + 1, y_val)
-            row += 1
-    workbook.close()
-    print("Data written to: " + xls_filename)
+            xls_filename = base + "_" + re.sub(r'[^\w.-]+', '_', key) + ".xlsx"
+        write_chrom_xls(chrom, xls_filename)
 
 
 styles = {'UV': {'color': '#1919FF', 'lw': 1.6, 'ls': "-", 'alpha': 1.0},
@@ -368,40 +391,95 @@ styles = {'UV': {'color': '#1919FF', 'lw': 1.6, 'ls': "-", 'alpha': 1.0},
           'pH': {'color': '#0C7F7F', 'lw': 1.0, 'ls': "-", 'alpha': 0.75}, }
 
 
+def collect_inputs(paths):
+    '''
+    expands directories (recursively) and glob patterns into a list of supported files
+    '''
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                for name in sorted(names):
+                    if name.lower().endswith(supported_ext):
+                        files.append(os.path.join(root, name))
+        elif glob.has_magic(path):
+            files.extend(f for f in sorted(glob.glob(path, recursive=True)) if f.lower().endswith(supported_ext))
+        else:
+            files.append(path)
+    return list(dict.fromkeys(files))
+
+
+def convert_file(fname, inject=-1):
+    '''
+    loads a single file and runs the actions requested on the command line,
+    inject = injection used as zero retention for .res files (-1 = last)
+    '''
+    print(fname[-3:])
+    if args.curves and (fname.lower().endswith(".zip") or fname.lower().endswith(".result")):
+        if args.curves == 'features':
+            curves = FEATURE_CURVES
+        else:
+            curves = [c.strip() for c in args.curves.split(',')]
+        fdata = load_curves(fname, curves)
+    elif (fname[-3:]).lower() == "zip":
+        fdata = PcUni6(fname)
+        fdata.load(print_log=True)
+        fdata.load_all_xml()
+    elif (fname[-6:]).lower() == "result":
+        fdata = PcUni6(fname)
+        fdata.load()
+        fdata.load_all_xml()
+        # fdata.clean_up()
+        # print(fdata['Chrom.1'].keys())
+        # print(fdata["Chrom.1"]["UV 1_280"]["data"][:10])
+    elif (fname[-3:]).lower() == "res":
+        fdata = PcRes3(fname, reduce=args.reduce, inj_sel=inject)
+        fdata.load()
+    else:
+        raise ValueError("Unsupported file type: " + fname)
+    curves_to_arrays(fdata)
+    if args.extract == 'csv':
+        data_writer1(fname, fdata)
+    if args.extract == 'xlsx' and xlsx == True:
+        generate_xls(fdata, fname)
+    if args.check:
+        fdata.input_check(show=True)
+    if args.info:
+        fdata.showheader()
+    if args.points:
+        fdata.inject_det(show=True)
+    if args.user:
+        user = fdata.get_user()
+        print("User: " + user)
+    if args.plot and plotting:
+        plotterX(fdata, fname)
+
+
+def safe_convert(fname, inject=-1):
+    '''
+    runs convert_file and captures any error, returns (fname, full traceback or None)
+    '''
+    try:
+        convert_file(fname, inject)
+    except Exception:
+        return fname, traceback.format_exc().strip()
+    return fname, None
+
+
 def main2():
-    for fname in args.inp_res:
-        print(fname[-3:])
-        if args.inject == None:
-            args.inject = -1
-        if (fname[-3:]).lower() == "zip":
-            fdata = PcUni6(fname)
-            fdata.load(print_log=True)
-            fdata.load_all_xml()
-        if (fname[-6:]).lower() == "result":
-            fdata = PcUni6(fname)
-            fdata.load()
-            fdata.load_all_xml()
-            # fdata.clean_up()
-            # print(fdata['Chrom.1'].keys())
-            # print(fdata["Chrom.1"]["UV 1_280"]["data"][:10])
-        if (fname[-3:]).lower() == "res":
-            fdata = PcRes3(fname, reduce=args.reduce, inj_sel=args.inject)
-            fdata.load()
-        if args.extract == 'csv':
-            data_writer1(fname, fdata)
-        if args.extract == 'xlsx' and xlsx == True:
-            generate_xls(fdata, fname)
-        if args.check:
-            fdata.input_check(show=True)
-        if args.info:
-            fdata.showheader()
-        if args.points:
-            fdata.inject_det(show=True)
-        if args.user:
-            user = fdata.get_user()
-            print("User: " + user)
-        if args.plot and plotting:
-            plotterX(fdata, fname)
-
-
-main2()
\ No newline at end of file
+    # passed to every worker explicitly, spawned workers parse the command line again
+    inject = -1 if args.inject is None else args.inject
+    files = collect_inputs(args.inp_res)
+    if args.workers > 1 and len(files) > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            results = list(pool.map(safe_convert, files, [inject] * len(files), chunksize=4))
+    else:
+        results = [safe_convert(fname, inject) for fname in files]
+    failed = [(fname, err) for fname, err in results if err is not None]
+    print("Processed %d file(s): %d ok, %d failed" % (len(results), len(results) - len(failed), len(failed)))
+    for fname, err in failed:
+        print("FAILED: " + fname + "\n" + err)
+
+
+if __name__ == '__main__':
+    main2()
@@ -0,0 +1,160 @@
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from akta_csv import read_akta_csv
+from export_schema import curve_names_by_column
+
+CACHE_DIR = os.environ.get('VVIRAL_CACHE_DIR', '.run_cache')
+CACHE_VERSION = 4
+
+# cell kinds used to store object (text/mixed) columns without pickling
+_NAN, _FLOAT, _INT, _STR = 0, 1, 2, 3
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """
+    This function takes in a file path and returns the sha1 hash of its content.
+    Args:
+        path: path of the file
+        chunk_size: number of bytes read at a time
+    Returns:
+        digest: hex digest of the file content
+    """
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def _encode_object_column(values):
+    kinds = np.zeros(len(values), dtype=np.int8)
+    nums = np.full(len(values), np.nan)
+    strs = np.full(len(values), '', dtype=object)
+    for i, v in enumerate(values):
+        if isinstance(v, str):
+            kinds[i] = _STR
+            strs[i] = v
+        elif isinstance(v, (int, np.integer)) and not isinstance(v, bool):
+            kinds[i] = _INT
+            nums[i] = v
+        elif isinstance(v, (float, np.floating)) and not np.isnan(v):
+            kinds[i] = _FLOAT
+            nums[i] = v
+    return kinds, nums, strs.astype(str)
+
+def _decode_object_column(kinds, nums, strs):
+    values = np.full(len(kinds), np.nan, dtype=object)
+    for kind, cast in ((_FLOAT, float), (_INT, int), (_STR, str)):
+        mask = kinds == kind
+        if mask.any():
+            src = strs[mask] if kind == _STR else nums[mask]
+            values[mask] = [cast(v) for v in src.tolist()]
+    return values
+
+def save_frame(df, path):
+    """
+    This function takes in a dataframe and stores it column by column in a .npz file.
+    Numeric columns are stored as they are (float32 stays float32), categorical columns as codes and
+    categories, text/mixed columns as kind, number and string arrays. df.attrs is stored as json.
+    Args:
+        df: dataframe
+        path: path of the .npz file
+    Returns:
+        None
+    """
+    arrays = {'__columns__': np.array([str(c) for c in df.columns]), '__attrs__': np.array(json.dumps(df.attrs))}
+    for i in range(df.shape[1]):
+        col = df.iloc[:, i]
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            arrays[f'c{i}'] = col.cat.codes.to_numpy()
+            arrays[f'categories{i}'] = col.cat.categories.to_numpy(dtype=str)
+        elif col.dtype.kind in 'biuf':
+            arrays[f'v{i}'] = col.to_numpy()
+        else:
+            arrays[f'k{i}'], arrays[f'n{i}'], arrays[f's{i}'] = _encode_object_column(col.to_numpy(dtype=object))
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+def load_frame(path):
+    """
+    This function takes in the path of a .npz file written by save_frame and returns the dataframe.
+    Args:
+        path: path of the .npz file
+    Returns:
+        df: dataframe
+    """
+    with np.load(path, allow_pickle=False) as npz:
+        columns = npz['__columns__'].tolist()
+        attrs = npz['__attrs__']
+        data = {}
+        for i in range(len(columns)):
+            if f'v{i}' in npz.files:
+                data[i] = npz[f'v{i}']
+            elif f'c{i}' in npz.files:
+                data[i] = pd.Categorical.from_codes(npz[f'c{i}'], npz[f'categories{i}'])
+            else:
+                data[i] = _decode_object_column(npz[f'k{i}'], npz[f'n{i}'], npz[f's{i}'])
+    df = pd.DataFrame(data)
+    df.columns = columns
+    df.attrs = json.loads(str(attrs))
+    return df
+
+def cached_read(path, reader, key, cache_dir=CACHE_DIR):
+    """
+    This function takes in a file path and a reader and returns the decoded dataframe.
+    The result is stored under the hash of the file content, so an unchanged file is only decoded once.
+    Args:
+        path: path of the file
+        reader: function that takes in a path and returns a dataframe
+        key: name of the reader, part of the cache file name
+        cache_dir: folder holding the cached runs
+    Returns:
+        df: dataframe
+    """
+    cache_file = os.path.join(cache_dir, f'{file_digest(path)}_{key}_v{CACHE_VERSION}.npz')
+    if os.path.exists(cache_file):
+        return load_frame(cache_file)
+    df = reader(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    save_frame(df, cache_file)
+    return df
+
+def read_csv_cached(path, cache_dir=CACHE_DIR):
+    """
+    This function takes in the path of a UTF-16 AKTA csv export and returns the channels read by read_akta_csv.
+    Args:
+        path: path of the csv file
+        cache_dir: folder holding the cached runs
+    Returns:
+        df: dataframe
+    """
+    return cached_read(path, read_akta_csv, 'csv', cache_dir)
+
+def read_excel_export(path):
+    """
+    This function takes in the path of an xlsx file written by pycorn-bin.py and returns the dataframe,
+    with the curve names of the first header row in df.attrs['curves'].
+    Args:
+        path: path of the xlsx file
+    Returns:
+        df: dataframe
+    """
+    df = pd.read_excel(path, skiprows=[0])
+    curve_row = pd.read_excel(path, header=None, nrows=1).iloc[0].tolist()
+    df.attrs['curves'] = curve_names_by_column(df.columns, curve_row)
+    return df
+
+def read_excel_cached(path, cache_dir=CACHE_DIR):
+    """
+    This function takes in the path of an xlsx file written by pycorn-bin.py and returns the dataframe.
+    Args:
+        path: path of the xlsx file
+        cache_dir: folder holding the cached runs
+    Returns:
+        df: dataframe
+    """
+    return cached_read(path, read_excel_export, 'xlsx', cache_dir)
@@ -1,6 +1,13 @@
 import os
-import re
+import numpy as np
 import matplotlib.pyplot as plt
+from export_schema import resolve_schema
+from file_names import parse_file_name
+from curve_ops import values_at_volumes, curve_window, index_to_volume
+from utils_xlsx import PhaseIndex, get_process_parameters, get_phase_statistics
+
+# the csv run log holds the phase names themselves instead of 'Phase <name> (Issued)' entries
+CSV_PHASE_PATTERN = r'^(.+)$'
 
 
 def make_dir_if_not_exists(folder):
@@ -27,43 +34,17 @@ def get_col_name_from_index(data, index):
 def load_useful_data(data):
     """
     This function takes in a dataframe and returns a dictionary with useful data.
+    The channels are resolved on the UNICORN curve names the reader kept in data.attrs['curves'].
     Args:
         data: dataframe
     Returns:
         data_dict: dictionary with useful data
+    Raises:
+        ValueError: if the dataframe has no curve names or they do not resolve to the channels of the schema
     """
-    pH = list(data.columns).index('pH')
-
-    uv_280 = list(data.columns).index('mAU')
-    uv_260 = list(data.columns).index('mAU.1')
-    conductivity = list(data.columns).index('mS/cm')
-    sample_flow = list(data.columns).index('CV/h')
-    system_flow = list(data.columns).index('CV/h.1')
-    sample_pressure = list(data.columns).index('MPa')
-    system_pressure = list(data.columns).index('MPa.1')
-    # run_log = list(data.columns).index('Logbook')
-    run_log = list(data.columns).index('Fraction.2')
-
-    ml_pH = pH - 1
-    ml_uv_280 = uv_280 - 1
-    ml_uv_260 = uv_260 - 1
-    ml_conductivity = conductivity - 1
-    ml_sample_flow = sample_flow - 1
-    ml_system_flow = system_flow - 1
-    ml_sample_pressure = sample_pressure - 1
-    ml_system_pressure = system_pressure - 1
-    ml_run_log = run_log - 1
-
-    data_dict = {'pH': [get_col_name_from_index(data, ml_pH), get_col_name_from_index(data, pH)],
-                'UV_280': [get_col_name_from_index(data, ml_uv_280), get_col_name_from_index(data, uv_280)], 
-                'UV_260': [get_col_name_from_index(data, ml_uv_260), get_col_name_from_index(data, uv_260)], 
-                'Conductivity': [get_col_name_from_index(data, ml_conductivity), get_col_name_from_index(data, conductivity)], 
-                'Sample Flow': [get_col_name_from_index(data, ml_sample_flow), get_col_name_from_index(data, sample_flow)], 
-                'System Flow': [get_col_name_from_index(data, ml_system_flow), get_col_name_from_index(data, system_flow)], 
-                'Sample Pressure': [get_col_name_from_index(data, ml_sample_pressure), get_col_name_from_index(data, sample_pressure)], 
-                'System Pressure': [get_col_name_from_index(data, ml_system_pressure), get_col_name_from_index(data, system_pressure)],
-                'Run Log': [get_col_name_from_index(data, ml_run_log), get_col_name_from_index(data, run_log)]}
-    return data_dict
+    if not data.attrs.get('curves'):
+        raise ValueError('no curve names in data.attrs, read the export with run_cache or akta_csv')
+    return resolve_schema(data.columns, data.attrs['curves'])
 
 def get_resin_and_serotype(name):
     """
@@ -74,13 +55,7 @@ def get_resin_and_serotype(name):
         resin: resin used
         serotype: serotype of AAV
     """
-    resin = re.findall(r'AAV[A-Z]\d+', name)
-    serotype = re.findall(r'AAV*\d+', name)
-    if len(resin) == 0:
-        resin = 'Unknown'
-    if len(serotype) == 0:
-        serotype = 'Unknown'
-    return resin[0], serotype[0]
+    return get_resin(name), get_serotype(name)
 
 def get_resin(name):
     """
@@ -90,14 +65,8 @@ def get_resin(name):
     Returns:
         resin: resin used
     """
-    resin = re.findall(r'AAV[A-Z]\d+', name)
-    if len(resin) == 0:
-        resin = re.findall(r'AAV[xX]', name)
-        if len(resin) == 0:
-            resin = re.findall(r'[aA]10', name)
-            if len(resin) == 0:
-                resin = 'Unknown'
-    return resin[0]
+    resin = parse_file_name(name).resin
+    return resin if resin is not None else 'U'
 
 def get_serotype(name):
     """
@@ -107,10 +76,8 @@ def get_serotype(name):
     Returns:
         serotype: serotype of AAV
     """
-    serotype = re.findall(r'AAV*\d+', name)
-    if len(serotype) == 0:
-        serotype = 'Unknown'
-    return serotype[0]
+    serotype = parse_file_name(name).serotype
+    return serotype if serotype is not None else 'U'
 
 def get_column_volume(name):
     """
@@ -120,10 +87,8 @@ def get_column_volume(name):
     Returns:    
         column_volume: column volume
     """
-    column_volume = re.findall(r'\d+(?:\.\d+)?[mM][lL]', name)
-    if len(column_volume) == 0:
-        column_volume = 'Unknown'
-    return column_volume[0]
+    column_volume = parse_file_name(name).column_volume
+    return column_volume if column_volume is not None else 'U'
 
 def is_pure(name):
     """
@@ -133,12 +98,7 @@ def is_pure(name):
     Returns:
         pure: True if the sample is pure, False otherwise
     """
-    pure = re.findall(r'[pP]ure', name)
-    if len(pure) == 0:
-        pure = False
-    else:
-        pure = True
-    return pure
+    return parse_file_name(name).pure
 
 def is_blank(name):
     """
@@ -148,12 +108,7 @@ def is_blank(name):
     Returns:
         pure: True if the run is blank, False otherwise
     """
-    blank = re.findall(r'[bB]lank', name)
-    if len(blank) == 0:
-        blank = False
-    else:
-        blank = True
-    return blank 
+    return parse_file_name(name).blank
 
 
 def plot_data(data, folder, name, data_dict, columns=['UV_280', 'Conductivity']):
@@ -182,194 +137,180 @@ def plot_data(data, folder, name, data_dict, columns=['UV_280', 'Conductivity'])
     fig.clf()
     fig.clear()
     
-def get_ph_and_cond_at_elution(df, data_dict):
+def get_phase_idx(df, log_col, *names):
+    """
+    This function takes in a dataframe, the run log column and phase names and returns the row of the
+    last entry of the first phase present in the log.
+    Args:
+        df: dataframe
+        log_col: name of the run log column
+        names: phase names in order of preference, e.g. 'Elution', 'Elution 1'
+    Returns:
+        row index, None if no name is present
+    """
+    log = df[log_col]
+    for name in names:
+        rows = np.flatnonzero(log.values == name)
+        if len(rows):
+            return log.index[rows[-1]]
+    return None
+
+def get_value_at_volume(df, ml_col, col, volume, interpolate=False):
+    """
+    This function takes in a dataframe, an ml column, a value column and a volume and returns the
+    value of the first sample at or after the volume (binary search on the ml column).
+    Args:
+        df: dataframe
+        ml_col: name of the ml column
+        col: name of the value column
+        volume: volume (ml)
+        interpolate: interpolate between the neighbouring samples instead
+    Returns:
+        value rounded to 2 decimals, None if the volume is outside the curve
+    """
+    value = values_at_volumes(df[ml_col], df[col], [volume], interpolate)[0]
+    return None if np.isnan(value) else round(float(value), 2)
+
+def get_channel_windows(df, data_dict, start, stop, channels=('UV_280',)):
+    """
+    This function takes in a dataframe, a dictionary with useful data and a volume range and returns every
+    channel inside the range as array views (no copies).
+    Args:
+        df: dataframe
+        data_dict: dictionary with useful data
+        start: first volume of the range (e.g. elution start)
+        stop: last volume of the range (e.g. CIP start)
+        channels: keys of data_dict to cut
+    Returns:
+        windows: dictionary with channel: (volume, values) pairs
+    """
+    windows = {}
+    for channel in channels:
+        ml_col, col = data_dict[channel]
+        windows[channel] = curve_window(df[ml_col].to_numpy(), df[col].to_numpy(), start, stop)
+    return windows
+
+def get_ph_and_cond_at_phase(df, data_dict, names, interpolate=False):
+    """
+    This function takes in a dataframe, a dictionary with useful data and phase names and returns the
+    pH and conductivity at the start of the first phase present.
+    Args:
+        df: dataframe
+        data_dict: dictionary with useful data
+        names: phase names in order of preference
+        interpolate: interpolate between the neighbouring samples
+    Returns:
+        ph: pH at the phase start
+        cond: conductivity at the phase start
+    """
+    ml_log_col, log_col = data_dict['Run Log']
+    phase_idx = get_phase_idx(df, log_col, *names)
+    if phase_idx is None:
+        return None, None
+    phase_ml = df[ml_log_col][phase_idx]
+    ph = get_value_at_volume(df, data_dict['pH'][0], data_dict['pH'][1], phase_ml, interpolate)
+    cond = get_value_at_volume(df, data_dict['Conductivity'][0], data_dict['Conductivity'][1], phase_ml, interpolate)
+    return ph, cond
+
+def get_sample_and_sytem_flow_rate_at_phase(df, data_dict, names, interpolate=False):
+    """
+    This function takes in a dataframe, a dictionary with useful data and phase names and returns the
+    sample and system flow rate at the start of the first phase present.
+    Args:
+        df: dataframe
+        data_dict: dictionary with useful data
+        names: phase names in order of preference
+        interpolate: interpolate between the neighbouring samples
+    Returns:
+        sample_flow: sample flow rate at the phase start
+        system_flow: system flow rate at the phase start
+    """
+    ml_log_col, log_col = data_dict['Run Log']
+    phase_idx = get_phase_idx(df, log_col, *names)
+    if phase_idx is None:
+        return None, None
+    phase_ml = df[ml_log_col][phase_idx]
+    sample_flow = get_value_at_volume(df, data_dict['Sample Flow'][0], data_dict['Sample Flow'][1], phase_ml, interpolate)
+    system_flow = get_value_at_volume(df, data_dict['System Flow'][0], data_dict['System Flow'][1], phase_ml, interpolate)
+    return sample_flow, system_flow
+
+def get_ph_and_cond_at_elution(df, data_dict, interpolate=False):
     """
     This function takes in a dataframe and a dictionary with useful data and returns the pH and conductivity at elution.
     Args:
         df: dataframe
         data_dict: dictionary with useful data
+        interpolate: interpolate between the neighbouring samples
     Returns:
         elution_ph: pH at elution
         elution_cond: conductivity at elution
     """
-    ml_pH_col = data_dict['pH'][0]
-    ml_cond_col = data_dict['Conductivity'][0]
-    log_col = data_dict['Run Log'][1]
-    ml_log_col = data_dict['Run Log'][0]
+    return get_ph_and_cond_at_phase(df, data_dict, ('Elution', 'Elution 1'), interpolate)
 
-    # print('elu')
-    elution_ph_index = df[ml_pH_col][round(df[ml_pH_col]) == round(df[ml_log_col][4])].index[1]
-    elution_cond_index = df[ml_cond_col][round(df[ml_cond_col]) == round(df[ml_log_col][4])].index[1]
-    elution_ph = round(df['pH'][elution_ph_index], 2)
-    elution_cond = round(df['mS/cm'][elution_cond_index], 2)
-
-    if 'Elution' in df[log_col].values:
-        elution_idx = df.index[df[log_col] == 'Elution'].tolist()[-1]
-        wash_ph_index = df[ml_pH_col][round(df[ml_pH_col]) == round(df[ml_log_col][elution_idx])].index[1]
-        wash_cond_index = df[ml_cond_col][round(df[ml_cond_col]) == round(df[ml_log_col][elution_idx])].index[1]
-        elution_ph = round(df['pH'][wash_ph_index], 2)
-        elution_cond = round(df['mS/cm'][wash_cond_index], 2)
-    elif 'Elution 1' in df[log_col].values:
-        elution_idx = df.index[df[log_col] == 'Elution 1'].tolist()[-1]
-        wash_ph_index = df[ml_pH_col][round(df[ml_pH_col]) == round(df[ml_log_col][elution_idx])].index[1]
-        wash_cond_index = df[ml_cond_col][round(df[ml_cond_col]) == round(df[ml_log_col][elution_idx])].index[1]
-        elution_ph = round(df['pH'][wash_ph_index], 2)
-        elution_cond = round(df['mS/cm'][wash_cond_index], 2)
-    else:
-        elution_ph = None
-        elution_cond = None
-    return elution_ph, elution_cond
-
-def get_ph_and_cond_at_wash(df, data_dict):
+def get_ph_and_cond_at_wash(df, data_dict, interpolate=False):
     """
     This function takes in a dataframe and a dictionary with useful data and returns the pH and conductivity at wash.
     Args:
         df: dataframe
         data_dict: dictionary with useful data
+        interpolate: interpolate between the neighbouring samples
     Returns:
         wash_ph: pH at wash
         wash_cond: conductivity at wash
     """
-    ml_pH_col = data_dict['pH'][0]
-    ml_cond_col = data_dict['Conductivity'][0]
-    log_col = data_dict['Run Log'][1]
-    ml_log_col = data_dict['Run Log'][0]
+    return get_ph_and_cond_at_phase(df, data_dict, ('Column Wash', 'Column Wash 1'), interpolate)
 
-    # print('wash')
-    if 'Column Wash' in df[log_col].values:
-        column_wash_idx = df.index[df[log_col] == 'Column Wash'].tolist()[-1]
-        wash_ph_index = df[ml_pH_col][round(df[ml_pH_col]) == round(df[ml_log_col][column_wash_idx])].index[1]
-        wash_cond_index = df[ml_cond_col][round(df[ml_cond_col]) == round(df[ml_log_col][column_wash_idx])].index[1]
-        wash_ph = round(df['pH'][wash_ph_index], 2)
-        wash_cond = round(df['mS/cm'][wash_cond_index], 2)
-    elif 'Column Wash 1' in df[log_col].values:
-        column_wash_idx = df.index[df['Logbook'] == 'Column Wash 1'].tolist()[-1]
-        wash_ph_index = df[ml_pH_col][round(df[ml_pH_col]) == round(df[ml_log_col][column_wash_idx])].index[1]
-        wash_cond_index = df[ml_cond_col][round(df[ml_cond_col]) == round(df[ml_log_col][column_wash_idx])].index[1]
-        wash_ph = round(df['pH'][wash_ph_index], 2)
-        wash_cond = round(df['mS/cm'][wash_cond_index], 2)
-    else:
-        wash_ph = None
-        wash_cond = None
-    return wash_ph, wash_cond
-
-def get_ph_and_cond_at_equilibration(df, data_dict):
+def get_ph_and_cond_at_equilibration(df, data_dict, interpolate=False):
     """
     This function takes in a dataframe and a dictionary with useful data and returns the pH and conductivity at equilibration.
     Args:
         df: dataframe
         data_dict: dictionary with useful data
+        interpolate: interpolate between the neighbouring samples
     Returns:
         equilibration_ph: pH at equilibration
         equilibration_cond: conductivity at equilibration
     """
-    ml_pH_col = data_dict['pH'][0]
-    ml_cond_col = data_dict['Conductivity'][0]
-    ml_log_col = data_dict['Run Log'][0]
-    log_col = data_dict['Run Log'][1]
-    ml_log_col = data_dict['Run Log'][0]
+    return get_ph_and_cond_at_phase(df, data_dict, ('Equilibration',), interpolate)
 
-    if 'Equilibration' in df[log_col].values:
-        column_equilibration_idx = df.index[df[log_col] == 'Equilibration'].tolist()[-1]
-        equilibration_ph_index = df[ml_pH_col][round(df[ml_pH_col]) == round(df[ml_log_col][column_equilibration_idx])].index[1]
-        equilibration_cond_index = df[ml_cond_col][round(df[ml_cond_col]) == round(df[ml_log_col][column_equilibration_idx])].index[1]
-        equilibration_ph = round(df['pH'][equilibration_ph_index], 2)
-        equilibration_cond = round(df['mS/cm'][equilibration_cond_index], 2)
-    else:
-        equilibration_ph = None
-        equilibration_cond = None
-
-    return equilibration_ph, equilibration_cond
-
-def get_sample_and_sytem_flow_rate_at_wash(df, data_dict):
+def get_sample_and_sytem_flow_rate_at_wash(df, data_dict, interpolate=False):
     """
     This function takes in a dataframe and a dictionary with useful data and returns the sample and system flow rate at wash.
     Args:
         df: dataframe
         data_dict: dictionary with useful data
+        interpolate: interpolate between the neighbouring samples
     Returns:
         sample_flow: sample flow rate at wash
         system_flow: system flow rate at wash
     """
-    ml_sample_flow_col = data_dict['Sample Flow'][0]
-    ml_system_flow_col = data_dict['System Flow'][0]
-    ml_log_col = data_dict['Run Log'][0]
-    log_col = data_dict['Run Log'][1]
+    return get_sample_and_sytem_flow_rate_at_phase(df, data_dict, ('Column Wash', 'Column Wash 1'), interpolate)
 
-    if 'Column Wash' in df[log_col].values:
-        column_wash_idx = df.index[df[log_col] == 'Column Wash'].tolist()[-1]
-    elif 'Column Wash 1' in df[log_col].values:
-        column_wash_idx = df.index[df[log_col] == 'Column Wash 1'].tolist()[-1]
-    else:
-        column_wash_idx = None
-
-    if column_wash_idx is not None:
-        system_wash_index = df[ml_system_flow_col][round(df[ml_system_flow_col]) == round(df[ml_log_col][column_wash_idx])].index[1]
-        sample_wash_index = df[ml_sample_flow_col][round(df[ml_sample_flow_col]) == round(df[ml_log_col][column_wash_idx])].index[1]
-        sample_flow = round(df[ml_sample_flow_col][system_wash_index], 2)
-        system_flow = round(df[ml_system_flow_col][sample_wash_index ], 2)
-    else:
-        sample_flow = None
-        system_flow = None
-    return sample_flow, system_flow
-
-def get_sample_and_sytem_flow_rate_at_elution(df, data_dict):
+def get_sample_and_sytem_flow_rate_at_elution(df, data_dict, interpolate=False):
     """
     This function takes in a dataframe and a dictionary with useful data and returns the sample and system flow rate at elution.
     Args:
         df: dataframe
         data_dict: dictionary with useful data
+        interpolate: interpolate between the neighbouring samples
     Returns:
         sample_flow: sample flow rate at elution
         system_flow: system flow rate at elution
     """
-    ml_sample_flow_col = data_dict['Sample Flow'][0]
-    ml_system_flow_col = data_dict['System Flow'][0]
-    ml_log_col = data_dict['Run Log'][0]
-    log_col = data_dict['Run Log'][1]
-
-    if 'Elution' in df[log_col].values:
-        elution_idx = df.index[df[log_col] == 'Elution'].tolist()[-1]
-        system_elution_index = df[ml_system_flow_col][round(df[ml_system_flow_col]) == round(df[ml_log_col][elution_idx])].index[1]
-        sample_elution_index = df[ml_sample_flow_col][round(df[ml_sample_flow_col]) == round(df[ml_log_col][elution_idx])].index[1]
-        sample_flow = round(df[ml_sample_flow_col][system_elution_index], 2)
-        system_flow = round(df[ml_system_flow_col][sample_elution_index ], 2)
-    elif 'Elution 1' in df[log_col].values:
-        elution_idx = df.index[df[log_col] == 'Elution 1'].tolist()[-1]
-        system_elution_index = df[ml_system_flow_col][round(df[ml_system_flow_col]) == round(df[ml_log_col][elution_idx])].index[1]
-        sample_elution_index = df[ml_sample_flow_col][round(df[ml_sample_flow_col]) == round(df[ml_log_col][elution_idx])].index[1]
-        sample_flow = round(df[ml_sample_flow_col][system_elution_index], 2)
-        system_flow = round(df[ml_system_flow_col][sample_elution_index ], 2)
-    else:
-        sample_flow = None
-        system_flow = None
-    return sample_flow, system_flow
+    return get_sample_and_sytem_flow_rate_at_phase(df, data_dict, ('Elution', 'Elution 1'), interpolate)
 
-def get_sample_and_sytem_flow_rate_at_equilibration(df, data_dict):
+def get_sample_and_sytem_flow_rate_at_equilibration(df, data_dict, interpolate=False):
     """
     This function takes in a dataframe and a dictionary with useful data and returns the sample and system flow rate at equilibration.
     Args:
         df: dataframe
         data_dict: dictionary with useful data
+        interpolate: interpolate between the neighbouring samples
     Returns:
         sample_flow: sample flow rate at equilibration
         system_flow: system flow rate at equilibration
     """
-    ml_sample_flow_col = data_dict['Sample Flow'][0]
-    ml_system_flow_col = data_dict['System Flow'][0]
-    ml_log_col = data_dict['Run Log'][0]
-    log_col = data_dict['Run Log'][1]
-
-    if 'Equilibration' in df[log_col].values:
-        equilibration_idx = df.index[df[log_col] == 'Equilibration'].tolist()[-1]
-        system_equilibration_index = df[ml_system_flow_col][round(df[ml_system_flow_col]) == round(df[ml_log_col][equilibration_idx])].index[1]
-        sample_equilibration_index = df[ml_sample_flow_col][round(df[ml_sample_flow_col]) == round(df[ml_log_col][equilibration_idx])].index[1]
-        sample_flow = round(df[ml_sample_flow_col][system_equilibration_index], 2)
-        system_flow = round(df[ml_system_flow_col][sample_equilibration_index ], 2)
-    else:
-        sample_flow = None
-        system_flow = None
-    return sample_flow, system_flow
+    return get_sample_and_sytem_flow_rate_at_phase(df, data_dict, ('Equilibration',), interpolate)
 
 def get_sample_volume(df, data_dict):
     """
@@ -383,17 +324,8 @@ def get_sample_volume(df, data_dict):
     ml_log_col = data_dict['Run Log'][0]
     log_col = data_dict['Run Log'][1]
 
-    if 'Column Wash' in df[log_col].values:
-        column_wash_idx = df.index[df[log_col] == 'Column Wash'].tolist()[-1]
-    elif 'Column Wash 1' in df[log_col].values:
-        column_wash_idx = df.index[df[log_col] == 'Column Wash 1'].tolist()[-1]
-    else:   
-        column_wash_idx = None
-
-    if 'Sample Application' in df[log_col].values:
-        sample_application_idx = df.index[df[log_col] == 'Sample Application'].tolist()[-1]
-    else:
-        sample_application_idx = None
+    column_wash_idx = get_phase_idx(df, log_col, 'Column Wash', 'Column Wash 1')
+    sample_application_idx = get_phase_idx(df, log_col, 'Sample Application')
     
     if column_wash_idx is not None and sample_application_idx is not None:
         sample_volume = df[ml_log_col][column_wash_idx] - df[ml_log_col][sample_application_idx]
@@ -402,6 +334,26 @@ def get_sample_volume(df, data_dict):
     return sample_volume
 
 
+def get_phase_features(df, data_dict, all_phases=False, phase_stats=False):
+    """
+    This function takes in a dataframe and a dictionary with useful data and returns the features of every
+    phase of the run, every run log entry starting a phase.
+    Args:
+        df: dataframe
+        data_dict: dictionary with useful data
+        all_phases: return every phase x channel value at the phase start (see utils_xlsx.get_process_parameters)
+        phase_stats: return the statistics of every phase x channel window (see utils_xlsx.get_phase_statistics)
+    Returns:
+        features: dictionary with the per-phase feature columns
+    """
+    phases = PhaseIndex(df, data_dict, CSV_PHASE_PATTERN)
+    features = {}
+    if all_phases:
+        features.update(get_process_parameters(df, data_dict, phases))
+    if phase_stats:
+        features.update(get_phase_statistics(df, data_dict, phases))
+    return features
+
 def get_start_stop_idx(dataframe):
     two_elutions = False
     try:
@@ -438,9 +390,18 @@ def get_start_stop_idx(dataframe):
 
 
 def query_line(volume, results):
-    row_0 = [i for i in results[0]]
-    row_1 = [volume[round(i)] for i in results[1]]
-    row_2 = [volume[round(i)] for i in results[2]]
+    """
+    This function takes in the volume axis of a run and the width heights, left and right positions of
+    peak_widths and returns the width lines in volumes (positions interpolated between samples).
+    Args:
+        volume: volumes of the run
+        results: peak_widths(...)[1:]
+    Returns:
+        [heights, left volumes, right volumes]
+    """
+    row_0 = np.asarray(results[0], dtype=float)
+    row_1 = index_to_volume(volume, results[1])
+    row_2 = index_to_volume(volume, results[2])
     return [row_0, row_1, row_2]
 
 def show_peaks(name, uv_280, volume, peaks, half_width, contour_heights):
@@ -0,0 +1,302 @@
+import io
+import os
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from zipfile import ZipFile
+import numpy as np
+import pandas as pd
+from pycorn import PcUni6, PcRes3
+from export_schema import curve_names_by_column
+from akta_csv import mangle_names
+from file_names import CHROM_KEY, CHROM_XML, natural_key
+
+
+CURVE_DTYPE = np.dtype([('x', '<f8'), ('y', '<f8')])
+# curves needed by the feature extraction (matched as case-insensitive prefixes)
+FEATURE_CURVES = ('UV 1_280', 'UV 2_260', 'Cond', 'pH', 'Sample flow', 'System flow', 'Sample pressure',
+                  'System pressure')
+
+
+def xy_data(inp):
+    """
+    This function takes in a data block and returns the x- and y-data.
+    Args:
+        inp: curve array (see curves_to_arrays) or list of (x, y) tuples
+    Returns:
+        x_data: x values (array view for curve arrays, list otherwise)
+        y_data: y values (array view for curve arrays, list otherwise)
+    """
+    if isinstance(inp, np.ndarray):
+        return inp['x'], inp['y']
+    x_data = [x[0] for x in inp]
+    y_data = [x[1] for x in inp]
+    return x_data, y_data
+
+def is_block(inp):
+    """
+    This function takes in an entry of a pycorn object and returns True if it is a data block.
+    Args:
+        inp: entry of a pycorn object
+    Returns:
+        True if inp is a data block, False otherwise
+    """
+    return isinstance(inp, dict) and 'data' in inp and 'data_name' in inp
+
+def is_curve(data):
+    """
+    This function takes in the data of a block and returns True if it holds numeric (x, y) samples.
+    Args:
+        data: data of a block
+    Returns:
+        True for curve data, False for events, metadata and empty blocks
+    """
+    if isinstance(data, np.ndarray):
+        return True
+    return isinstance(data, list) and len(data) > 0 and not isinstance(data[0][1], str)
+
+def curves_to_arrays(fdata):
+    """
+    This function takes in a pycorn object and replaces, in place, the list of (x, y) tuples of every
+    curve block by one structured array with float64 fields x and y. Rows still unpack as (x, y), so
+    data[0][0] and "for x, y in data" keep working. Event and metadata blocks are left as they are.
+    Args:
+        fdata: PcUni6 or PcRes3 object
+    Returns:
+        fdata: the same object
+    """
+    blocks = [v for v in fdata.values() if is_block(v)]
+    for chrom in get_chroms(fdata).values():
+        blocks.extend(v for v in chrom.values() if is_block(v))
+    for block in blocks:
+        if is_curve(block['data']) and not isinstance(block['data'], np.ndarray):
+            block['data'] = np.array(block['data'], dtype=CURVE_DTYPE)
+    return fdata
+
+def unpack_values(raw):
+    """
+    This function takes in a UNICORN 6 binary data block and returns its float32 values
+    as a view of the buffer (same layout as the pycorn unpacker: 47 byte header, 48 byte trailer).
+    Args:
+        raw: bytes of a CoordinateData.Volumes/Amplitudes entry
+    Returns:
+        values: float32 array
+    """
+    return np.frombuffer(raw, dtype='<f4', count=len(range(47, len(raw) - 48, 4)), offset=47)
+
+def wanted_curve(name, curves):
+    """
+    This function takes in a curve name and a list of requested curves and returns True if the curve was requested.
+    Args:
+        name: name of the curve
+        curves: list of curve names (case-insensitive prefixes)
+    Returns:
+        True if name starts with one of curves, False otherwise
+    """
+    return name.lower().startswith(tuple(c.lower() for c in curves))
+
+def read_chrom(input_zip, xml_name, curves):
+    """
+    This function takes in an opened UNICORN 6 archive and the name of a chromatogram xml and returns its
+    data blocks. Events are parsed from the xml, only the requested curves are decompressed and decoded.
+    Args:
+        input_zip: ZipFile of the archive
+        xml_name: name of the chromatogram xml member (e.g. Chrom.1.Xml)
+        curves: list of curve names (case-insensitive prefixes)
+    Returns:
+        chrom: dictionary with data_name: data block pairs
+    """
+    prefix = xml_name[:xml_name.rfind('/') + 1]
+    tree = ET.fromstring(input_zip.read(xml_name))
+    chrom = {}
+    chrom_id = tree.findtext('ChromatogramID')
+    column_vol = None
+    for curve in tree.iter('EventCurve'):
+        if column_vol is None and curve.findtext('ColumnVolume'):
+            column_vol = float(curve.findtext('ColumnVolume'))
+        if curve.findtext('IsOriginalData', 'true') != 'true':
+            continue
+        e_name = curve.findtext('Name')
+        if e_name == 'Fraction':
+            e_name = 'Fractions'
+        e_data = [(float(e.findtext('EventVolume')), e.findtext('EventText')) for e in curve.iter('Event')]
+        chrom[e_name] = {'run_name': 'Blank', 'data': e_data, 'data_name': e_name, 'data_type': 'annotation'}
+    if 'Injection' in chrom:
+        chrom['Injection']['chrom_id'] = chrom_id
+        chrom['Injection']['column_vol'] = column_vol
+    for curve in tree.iter('Curve'):
+        d_name = curve.findtext('Name')
+        if curve.findtext('IsOriginalData', 'true') != 'true' or not wanted_curve(d_name, curves):
+            continue
+        points = curve.find('CurvePoints')[0]
+        d_fname = points.findtext('BinaryCurvePointsFileName') or points[1].text
+        with ZipFile(io.BytesIO(input_zip.read(prefix + d_fname))) as curve_zip:
+            x_dat = unpack_values(curve_zip.read('CoordinateData.Volumes'))
+            y_dat = unpack_values(curve_zip.read('CoordinateData.Amplitudes'))
+        data = np.empty(min(len(x_dat), len(y_dat)), dtype=CURVE_DTYPE)
+        data['x'], data['y'] = x_dat[:len(data)], y_dat[:len(data)]
+        chrom[d_name] = {'run_name': 'Blank', 'data': data, 'unit': curve.findtext('AmplitudeUnit'),
+                         'data_name': d_name, 'data_type': 'curve'}
+    return chrom
+
+def load_curves(fname, curves=FEATURE_CURVES, workers=None):
+    """
+    This function takes in the path of a UNICORN 6+ export and returns a PcUni6 object holding only the
+    requested curves (plus all events and the ChromID/column volume) of every chromatogram in the archive,
+    without decoding the other blocks. Chromatograms are decoded in parallel threads.
+    Args:
+        fname: path of a .zip/.Result file
+        curves: list of curve names (case-insensitive prefixes)
+        workers: number of threads (None = ThreadPoolExecutor default)
+    Returns:
+        fdata: PcUni6 object with the blocks of each chromatogram under its name (e.g. 'Chrom.1')
+    """
+    fdata = PcUni6(fname)
+    with ZipFile(fname) as input_zip:
+        xml_names = sorted((n for n in input_zip.namelist() if CHROM_XML.search(n)), key=natural_key)
+        if len(xml_names) == 0:
+            raise KeyError(f'No chromatogram found in {fname}')
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            chroms = pool.map(lambda n: read_chrom(input_zip, n, curves), xml_names)
+            for xml_name, chrom in zip(xml_names, chroms):
+                fdata[xml_name[:-len('.Xml')]] = chrom
+    return fdata
+
+def load_run(fname, curves=None):
+    """
+    This function takes in the path of a UNICORN export and returns the loaded pycorn object.
+    Args:
+        fname: path of a .zip/.Result (UNICORN 6+) or .res (UNICORN 3-5) file
+        curves: list of curves to decode from .zip/.Result files (None = load everything)
+    Returns:
+        fdata: PcUni6 or PcRes3 object with curves stored as arrays
+    """
+    if curves is not None and fname.lower().endswith(('.zip', '.result')):
+        fdata = load_curves(fname, curves)
+    elif fname.lower().endswith(('.zip', '.result')):
+        fdata = PcUni6(fname)
+        fdata.load()
+        fdata.load_all_xml()
+    elif fname.lower().endswith('.res'):
+        fdata = PcRes3(fname)
+        fdata.load()
+    else:
+        raise ValueError(f'Unsupported file type: {fname}')
+    return curves_to_arrays(fdata)
+
+def get_chroms(fdata):
+    """
+    This function takes in a pycorn object and returns the data blocks of every chromatogram it holds.
+    Args:
+        fdata: PcUni6 or PcRes3 object
+    Returns:
+        chroms: dictionary with chromatogram name: (dictionary with data_name: data block pairs)
+    """
+    keys = sorted((k for k, v in fdata.items() if CHROM_KEY.search(k) and isinstance(v, dict)), key=natural_key)
+    if len(keys) == 0:
+        # PcRes3 (and plain pycorn) objects hold the blocks of their single run at the top level
+        return {'Chrom.1': {k: v for k, v in fdata.items() if is_block(v) and v.get('data_type') != 'meta'}}
+    return {k: fdata[k] for k in keys}
+
+def get_chrom(fdata):
+    """
+    This function takes in a pycorn object and returns the data blocks of its first chromatogram.
+    Args:
+        fdata: PcUni6 or PcRes3 object
+    Returns:
+        chrom: dictionary with data_name: data block pairs
+    """
+    return next(iter(get_chroms(fdata).values()))
+
+def chrom_columns(name, block, inj_point):
+    """
+    This function takes in a data block and returns its two xlsx columns, with the injection point
+    subtracted from the x-data. The Injection block also carries the ChromID and column volume.
+    Args:
+        name: name of the block in the chromatogram
+        block: data block
+        inj_point: injection volume
+    Returns:
+        columns: two (header1, header2, data) tuples for the x- and y-column
+    """
+    try:
+        unit = block['unit']
+    except KeyError:
+        unit = 'Fraction'
+    if block['data_name'] == 'pH':
+        header2 = ('ml', 'pH')
+    else:
+        header2 = ('ml', unit)
+    x_dat, y_dat = xy_data(block['data'])
+    x_dat = np.asarray(x_dat, dtype=float) - inj_point
+    if name == 'Injection':
+        x_dat = x_dat.tolist() + [block['chrom_id'], block['column_vol']]
+        y_dat = list(y_dat) + ["ChromID", "ColumnVolume (ml)"]
+    return (block['data_name'], header2[0], x_dat), ('', header2[1], y_dat)
+
+def get_injection_point(chrom):
+    """
+    This function takes in the data blocks of a chromatogram and returns the volume of the first injection.
+    Args:
+        chrom: dictionary with data_name: data block pairs
+    Returns:
+        inj_point: injection volume (0 if the run has no injection block)
+    """
+    if 'Injection' in chrom and len(chrom['Injection']['data']) > 0:
+        return chrom['Injection']['data'][0][0]
+    return 0.0
+
+def chrom_frame(chrom):
+    """
+    This function takes in the data blocks of a chromatogram and returns them as a dataframe with the
+    same layout as the xlsx written by pycorn-bin.py and read back with pd.read_excel(skiprows=[0]).
+    The feature getters of utils_xlsx work on that layout, so the block arrays go through this frame
+    (shorter curves padded with NaN) instead of reaching them directly.
+    The curve names of the first header row are kept in df.attrs['curves'].
+    Args:
+        chrom: dictionary with data_name: data block pairs
+    Returns:
+        df: dataframe
+    """
+    inj_point = get_injection_point(chrom)
+    curve_row, names, columns = [], [], []
+    for i in chrom.keys():
+        for head1, head2, dat in chrom_columns(i, chrom[i], inj_point):
+            curve_row.append(head1)
+            names.append(head2)
+            columns.append(pd.Series(dat))
+    df = pd.DataFrame(dict(enumerate(columns)))
+    df.columns = mangle_names(names)
+    df.attrs['curves'] = curve_names_by_column(df.columns, curve_row)
+    return df
+
+def get_features_from_run(fdata, path):
+    """
+    This function takes in a loaded pycorn object and returns one feature row per chromatogram.
+    Args:
+        fdata: PcUni6 or PcRes3 object
+        path: path of the file the object was loaded from
+    Returns:
+        rows: list of dictionaries with the columns of the collated table, keyed by their ChromID
+    """
+    # imported here, utils_xlsx needs matplotlib and pycorn-bin.py must run without it
+    from utils_xlsx import load_useful_data, get_file_info, get_run_features
+    name = os.path.splitext(os.path.basename(path))[0]
+    info = get_file_info(path, name)
+    rows = []
+    for chrom in get_chroms(fdata).values():
+        df = chrom_frame(chrom)
+        data_dict = load_useful_data(df)
+        rows.append({**info, **get_run_features(df, data_dict, all_phases=True, phase_stats=True)})
+    return rows
+
+def get_features_from_file(path, curves=FEATURE_CURVES):
+    """
+    This function takes in the path of a UNICORN export and returns the feature rows of its chromatograms
+    without writing an xlsx.
+    Args:
+        path: path of the .zip/.Result/.res file
+        curves: list of curves to decode (None = load everything)
+    Returns:
+        rows: list of dictionaries with the columns of the collated table, one per chromatogram
+    """
+    return get_features_from_run(load_run(path, curves), path)
@@ -1,7 +1,10 @@
 import os
-import re
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
+from export_schema import resolve_schema
+from file_names import parse_file_name
+from curve_ops import values_at_volumes, window_stats, index_to_volume
 
 
 def make_dir_if_not_exists(folder):
@@ -28,46 +31,17 @@ def get_col_name_from_index(data, index):
 def load_useful_data(data):
     """
     This function takes in a dataframe and returns a dictionary with useful data.
+    The channels are resolved on the UNICORN curve names the reader kept in data.attrs['curves'].
     Args:
         data: dataframe
     Returns:
         data_dict: dictionary with useful data
+    Raises:
+        ValueError: if the dataframe has no curve names or they do not resolve to the channels of the schema
     """
-    pH = list(data.columns).index('pH')
-
-    uv_280 = list(data.columns).index('mAU')
-    uv_260 = list(data.columns).index('mAU.1')
-    conductivity = list(data.columns).index('mS/cm')
-    sample_flow = list(data.columns).index('CV/h')
-    system_flow = list(data.columns).index('CV/h.1')
-    sample_pressure = list(data.columns).index('MPa')
-    system_pressure = list(data.columns).index('MPa.1')
-    # run_log = list(data.columns).index('Logbook')
-    run_log = list(data.columns).index('Fraction.2')
-    injection = list(data.columns).index('Fraction.1')
-
-    ml_pH = pH - 1
-    ml_uv_280 = uv_280 - 1
-    ml_uv_260 = uv_260 - 1
-    ml_conductivity = conductivity - 1
-    ml_sample_flow = sample_flow - 1
-    ml_system_flow = system_flow - 1
-    ml_sample_pressure = sample_pressure - 1
-    ml_system_pressure = system_pressure - 1
-    ml_run_log = run_log - 1
-    ml_injection = injection - 1
-
-    data_dict = {'pH': [get_col_name_from_index(data, ml_pH), get_col_name_from_index(data, pH)],
-                'UV_280': [get_col_name_from_index(data, ml_uv_280), get_col_name_from_index(data, uv_280)], 
-                'UV_260': [get_col_name_from_index(data, ml_uv_260), get_col_name_from_index(data, uv_260)], 
-                'Conductivity': [get_col_name_from_index(data, ml_conductivity), get_col_name_from_index(data, conductivity)], 
-                'Sample Flow': [get_col_name_from_index(data, ml_sample_flow), get_col_name_from_index(data, sample_flow)], 
-                'System Flow': [get_col_name_from_index(data, ml_system_flow), get_col_name_from_index(data, system_flow)], 
-                'Sample Pressure': [get_col_name_from_index(data, ml_sample_pressure), get_col_name_from_index(data, sample_pressure)], 
-                'System Pressure': [get_col_name_from_index(data, ml_system_pressure), get_col_name_from_index(data, system_pressure)],
-                'Run Log': [get_col_name_from_index(data, ml_run_log), get_col_name_from_index(data, run_log)],
-                'Injection': [get_col_name_from_index(data, ml_injection), get_col_name_from_index(data, injection)]}
-    return data_dict
+    if not data.attrs.get('curves'):
+        raise ValueError('no curve names in data.attrs, read the export with run_cache or akta_csv')
+    return resolve_schema(data.columns, data.attrs['curves'])
 
 def get_chrom_id(df, data_dict):
     """
@@ -116,14 +90,8 @@ def get_resin(name):
     Returns:
         resin: resin used
     """
-    resin = re.findall(r'AAV[A-Z]\d+', name)
-    if len(resin) == 0:
-        resin = re.findall(r'AAV[xX]', name)
-        if len(resin) == 0:
-            resin = re.findall(r'[aA]10', name)
-            if len(resin) == 0:
-                resin = 'Unknown'
-    return resin[0]
+    resin = parse_file_name(name).resin
+    return resin if resin is not None else 'U'
 
 def get_serotype(name):
     """
@@ -133,10 +101,8 @@ def get_serotype(name):
     Returns:
         serotype: serotype of AAV
     """
-    serotype = re.findall(r'AAV*\d+', name)
-    if len(serotype) == 0:
-        serotype = 'Unknown'
-    return serotype[0]
+    serotype = parse_file_name(name).serotype
+    return serotype if serotype is not None else 'U'
 
 def get_resin_and_serotype(name):
     """
@@ -160,10 +126,8 @@ def get_column_volume(name):
     Returns:    
         column_volume: column volume
     """
-    column_volume = re.findall(r'\d+(?:\.\d+)?[mM][lL]', name)
-    if len(column_volume) == 0:
-        column_volume = 'Unknown'
-    return column_volume[0]
+    column_volume = parse_file_name(name).column_volume
+    return column_volume if column_volume is not None else 'U'
 
 def is_pure(name):
     """
@@ -173,12 +137,7 @@ def is_pure(name):
     Returns:
         pure: True if the sample is pure, False otherwise
     """
-    pure = re.findall(r'[pP]ure', name)
-    if len(pure) == 0:
-        pure = False
-    else:
-        pure = True
-    return pure
+    return parse_file_name(name).pure
 
 def is_blank(name):
     """
@@ -188,12 +147,7 @@ def is_blank(name):
     Returns:
         pure: True if the run is blank, False otherwise
     """
-    blank = re.findall(r'[bB]lank', name)
-    if len(blank) == 0:
-        blank = False
-    else:
-        blank = True
-    return blank 
+    return parse_file_name(name).blank
 
 
 def plot_data(data, folder, name, data_dict, columns=['UV_280', 'Conductivity']):
@@ -222,246 +176,352 @@ def plot_data(data, folder, name, data_dict, columns=['UV_280', 'Conductivity'])
     fig.clf()
     fig.clear()
 
-def get_useful_log_idx(data):
-    log_name = []
-    useful_log_idx = []
-    for i in range(len(data)):
-        if type(data['Fraction.2'].values[i]) == str:
-            if data['Fraction.2'].values[i][:5] == "Phase":
-                j = data['Fraction.2'].values[i]
-                log_name.append(re.search(r'Phase (.*?) \(Issued\)', j).group(1))
-                useful_log_idx.append(i)
-    return log_name, useful_log_idx
-    
-def get_ph_and_cond_at_elution(df, data_dict):
+class PhaseIndex:
+    """
+    This class holds the phases of a run, found with one vectorized scan of the run log
+    ("Phase <name> (Issued)" entries). Build it once per run and pass it to the feature getters.
+    Args:
+        df: dataframe
+        data_dict: dictionary with useful data
+        pattern: regex with one group for the phase name (default: the "Phase <name> (Issued)" entries)
+    Raises:
+        TypeError: if the run log is not a text (object or categorical) column
+    Attributes:
+        names: phase names in run order (with repeats)
+        rows: row of each entry in names
+        volumes: volume (ml) of each entry in names
+    """
+    pattern = r'^Phase (.*?) \(Issued\)'
+
+    def __init__(self, df, data_dict, pattern=None):
+        ml_log_col, log_col = data_dict['Run Log']
+        log = df[log_col].dropna()
+        if isinstance(log.dtype, pd.CategoricalDtype):
+            # the csv reader keeps text channels as categoricals
+            log = log.astype(str)
+        if len(log) == 0:
+            found = pd.Series([], dtype=object)
+        elif log.dtype == object:
+            found = log.str.extract(pattern or self.pattern, expand=False).dropna()
+        else:
+            raise TypeError(f'{log_col}: run log has dtype {log.dtype}, expected text')
+        self.names = found.tolist()
+        self.rows = found.index.tolist()
+        self.volumes = df[ml_log_col].loc[found.index].to_numpy()
+        self._first = {}
+        for i, name in enumerate(self.names):
+            self._first.setdefault(name, i)
+
+    def __contains__(self, name):
+        return name in self._first
+
+    def first(self, *names):
+        """
+        This function takes in phase names and returns the position (in names) of the first one present.
+        Args:
+            names: phase names in order of preference, e.g. 'Elution', 'Elution 1'
+        Returns:
+            position of its first occurrence, None if no name is present
+        """
+        for name in names:
+            if name in self._first:
+                return self._first[name]
+        return None
+
+    def row(self, *names):
+        """
+        This function takes in phase names and returns the row where the first one present starts.
+        Args:
+            names: phase names in order of preference
+        Returns:
+            row index, None if no name is present
+        """
+        i = self.first(*names)
+        return None if i is None else self.rows[i]
+
+    def volume(self, *names):
+        """
+        This function takes in phase names and returns the volume where the first one present starts.
+        Args:
+            names: phase names in order of preference
+        Returns:
+            volume (ml), None if no name is present
+        """
+        i = self.first(*names)
+        return None if i is None else self.volumes[i]
+
+def get_value_at_volume(df, ml_col, col, volume, interpolate=False):
+    """
+    This function takes in a dataframe, an ml column, a value column and a volume and returns the
+    value of the first sample at or after the volume (binary search on the ml column).
+    Args:
+        df: dataframe
+        ml_col: name of the ml column
+        col: name of the value column
+        volume: volume (ml)
+        interpolate: interpolate between the neighbouring samples instead
+    Returns:
+        value rounded to 2 decimals, None if the volume is outside the curve
+    """
+    value = values_at_volumes(df[ml_col], df[col], [volume], interpolate)[0]
+    return None if np.isnan(value) else round(float(value), 2)
+
+def get_ph_and_cond_at_phase(df, data_dict, phases, *names):
+    """
+    This function takes in a dataframe, a dictionary with useful data, the phases of the run and phase names
+    and returns the pH and conductivity at the start of the first phase present.
+    Args:
+        df: dataframe
+        data_dict: dictionary with useful data
+        phases: PhaseIndex of the run
+        names: phase names in order of preference
+    Returns:
+        ph: pH at the phase start
+        cond: conductivity at the phase start
+    """
+    phase_ml = phases.volume(*names)
+    if phase_ml is None:
+        return None, None
+    ph = get_value_at_volume(df, data_dict['pH'][0], data_dict['pH'][1], phase_ml)
+    cond = get_value_at_volume(df, data_dict['Conductivity'][0], data_dict['Conductivity'][1], phase_ml)
+    return ph, cond
+
+def get_sample_and_sytem_flow_rate_at_phase(df, data_dict, phases, *names):
+    """
+    This function takes in a dataframe, a dictionary with useful data, the phases of the run and phase names
+    and returns the sample and system flow rate at the start of the first phase present.
+    Args:
+        df: dataframe
+        data_dict: dictionary with useful data
+        phases: PhaseIndex of the run
+        names: phase names in order of preference
+    Returns:
+        sample_flow: sample flow rate at the phase start
+        system_flow: system flow rate at the phase start
+    """
+    phase_ml = phases.volume(*names)
+    if phase_ml is None:
+        return None, None
+    sample_flow = get_value_at_volume(df, data_dict['Sample Flow'][0], data_dict['Sample Flow'][1], phase_ml)
+    system_flow = get_value_at_volume(df, data_dict['System Flow'][0], data_dict['System Flow'][1], phase_ml)
+    return sample_flow, system_flow
+
+def get_ph_and_cond_at_elution(df, data_dict, phases=None):
     """
     This function takes in a dataframe and a dictionary with useful data and returns the pH and conductivity at elution.
     Args:
         df: dataframe
         data_dict: dictionary with useful data
+        phases: PhaseIndex of the run (built from df if None)
     Returns:
         elution_ph: pH at elution
         elution_cond: conductivity at elution
     """
-    ml_pH_col = data_dict['pH'][0]
-    ml_cond_col = data_dict['Conductivity'][0]
-    ml_log_col = data_dict['Run Log'][0]
-
-    run_log, useful_log_idx = get_useful_log_idx(df)
-
-    if 'Elution' in run_log:
-        elution_idx = useful_log_idx[run_log.index('Elution')]
-        elution_ml = df[ml_log_col][elution_idx]
-        elution_ph_idx = np.searchsorted(df[ml_pH_col], elution_ml, side="left")
-        elution_cond_idx = np.searchsorted(df[ml_cond_col], elution_ml, side="left")
-        elution_ph = round(df['pH'][elution_ph_idx], 2)
-        elution_cond = round(df['mS/cm'][elution_cond_idx], 2)
-    elif 'Elution 1' in run_log:
-        elution_idx = useful_log_idx[run_log.index('Elution 1')]
-        elution_ml = df[ml_log_col][elution_idx]
-        elution_ph_idx = np.searchsorted(ml_pH_col, elution_ml, side="left")
-        elution_cond_idx = np.searchsorted(ml_cond_col, elution_ml, side="left")
-        elution_ph = round(df['pH'][elution_ph_idx], 2)
-        elution_cond = round(df['mS/cm'][elution_cond_idx], 2)
-    else:
-        elution_ph = None
-        elution_cond = None
-    return elution_ph, elution_cond
+    if phases is None:
+        phases = PhaseIndex(df, data_dict)
+    return get_ph_and_cond_at_phase(df, data_dict, phases, 'Elution', 'Elution 1')
 
-def get_ph_and_cond_at_wash(df, data_dict):
+def get_ph_and_cond_at_wash(df, data_dict, phases=None):
     """
     This function takes in a dataframe and a dictionary with useful data and returns the pH and conductivity at wash.
     Args:
         df: dataframe
         data_dict: dictionary with useful data
+        phases: PhaseIndex of the run (built from df if None)
     Returns:
         wash_ph: pH at wash
         wash_cond: conductivity at wash
     """
-    ml_pH_col = data_dict['pH'][0]
-    ml_cond_col = data_dict['Conductivity'][0]
-    ml_log_col = data_dict['Run Log'][0]
-
-    run_log, useful_log_idx = get_useful_log_idx(df)
-
-    # print('wash')
-    if 'Column Wash' in run_log:
-        column_wash_idx = useful_log_idx[run_log.index('Column Wash')]
-        column_wash_ml = df[ml_log_col][column_wash_idx]
-        wash_ph_index = np.searchsorted(df[ml_pH_col], column_wash_ml, side="left")
-        wash_cond_index = np.searchsorted(df[ml_cond_col], column_wash_ml, side="left")
-        wash_ph = round(df['pH'][wash_ph_index], 2)
-        wash_cond = round(df['mS/cm'][wash_cond_index], 2)
-    elif 'Column Wash 1' in run_log:
-        column_wash_idx = useful_log_idx[run_log.index('Column Wash 1')]
-        column_wash_ml = df[ml_log_col][column_wash_idx]
-        wash_ph_index = np.searchsorted(df[ml_pH_col], column_wash_ml, side="left")
-        wash_cond_index = np.searchsorted(df[ml_cond_col], column_wash_ml, side="left")
-        wash_ph = round(df['pH'][wash_ph_index], 2)
-        wash_cond = round(df['mS/cm'][wash_cond_index], 2)
-    else:
-        wash_ph = None
-        wash_cond = None
-    return wash_ph, wash_cond
+    if phases is None:
+        phases = PhaseIndex(df, data_dict)
+    return get_ph_and_cond_at_phase(df, data_dict, phases, 'Column Wash', 'Column Wash 1')
 
-def get_ph_and_cond_at_equilibration(df, data_dict):
+def get_ph_and_cond_at_equilibration(df, data_dict, phases=None):
     """
     This function takes in a dataframe and a dictionary with useful data and returns the pH and conductivity at equilibration.
     Args:
         df: dataframe
         data_dict: dictionary with useful data
+        phases: PhaseIndex of the run (built from df if None)
     Returns:
         equilibration_ph: pH at equilibration
         equilibration_cond: conductivity at equilibration
     """
-    ml_pH_col = data_dict['pH'][0]
-    ml_cond_col = data_dict['Conductivity'][0]
-    ml_log_col = data_dict['Run Log'][0]
+    if phases is None:
+        phases = PhaseIndex(df, data_dict)
+    return get_ph_and_cond_at_phase(df, data_dict, phases, 'Equilibration')
 
-    run_log, useful_log_idx = get_useful_log_idx(df)
-
-    if 'Equilibration' in run_log:
-        column_equilibration_idx = useful_log_idx[run_log.index('Equilibration')]
-        column_equilibration_ml = df[ml_log_col][column_equilibration_idx]
-        equilibration_ph_index = np.searchsorted(df[ml_pH_col], column_equilibration_ml, side="left")
-        equilibration_cond_index = np.searchsorted(df[ml_cond_col], column_equilibration_ml, side="left")
-        equilibration_ph = round(df['pH'][equilibration_ph_index], 2)
-        equilibration_cond = round(df['mS/cm'][equilibration_cond_index], 2)
-    else:
-        equilibration_ph = None
-        equilibration_cond = None
-
-    return equilibration_ph, equilibration_cond
-
-def get_sample_and_sytem_flow_rate_at_wash(df, data_dict):
+def get_sample_and_sytem_flow_rate_at_wash(df, data_dict, phases=None):
     """
     This function takes in a dataframe and a dictionary with useful data and returns the sample and system flow rate at wash.
     Args:
         df: dataframe
         data_dict: dictionary with useful data
+        phases: PhaseIndex of the run (built from df if None)
     Returns:
         sample_flow: sample flow rate at wash
         system_flow: system flow rate at wash
     """
-    ml_sample_flow_col = data_dict['Sample Flow'][0]
-    ml_system_flow_col = data_dict['System Flow'][0]
-    ml_log_col = data_dict['Run Log'][0]
-    
-    run_log, useful_log_idx = get_useful_log_idx(df)
-
-    if 'Column Wash' in run_log:
-        column_wash_idx = useful_log_idx[run_log.index('Column Wash')]
-    elif 'Column Wash 1' in run_log:
-        column_wash_idx = useful_log_idx[run_log.index('Column Wash 1')]
-    else:
-        column_wash_idx = None
-
-
-    if column_wash_idx is not None:
-        column_wash_ml = df[ml_log_col][column_wash_idx]
-        sample_wash_index = np.searchsorted(df[ml_sample_flow_col], column_wash_ml, side="left")
-        system_wash_index = np.searchsorted(df[ml_system_flow_col], column_wash_ml, side="left")
-        sample_flow = round(df[ml_sample_flow_col][sample_wash_index], 2)
-        system_flow = round(df[ml_system_flow_col][system_wash_index ], 2)
-    else:
-        sample_flow = None
-        system_flow = None
-    return sample_flow, system_flow
+    if phases is None:
+        phases = PhaseIndex(df, data_dict)
+    return get_sample_and_sytem_flow_rate_at_phase(df, data_dict, phases, 'Column Wash', 'Column Wash 1')
 
-def get_sample_and_sytem_flow_rate_at_elution(df, data_dict):
+def get_sample_and_sytem_flow_rate_at_elution(df, data_dict, phases=None):
     """
     This function takes in a dataframe and a dictionary with useful data and returns the sample and system flow rate at elution.
     Args:
         df: dataframe
         data_dict: dictionary with useful data
+        phases: PhaseIndex of the run (built from df if None)
     Returns:
         sample_flow: sample flow rate at elution
         system_flow: system flow rate at elution
     """
-    ml_sample_flow_col = data_dict['Sample Flow'][0]
-    ml_system_flow_col = data_dict['System Flow'][0]
-    ml_log_col = data_dict['Run Log'][0]
-
-    run_log, useful_log_idx = get_useful_log_idx(df)
-
-    if 'Elution' in run_log:
-        elution_idx = useful_log_idx[run_log.index('Elution')]
-        elution_ml = df[ml_log_col][elution_idx]
-        system_elution_index = np.searchsorted(df[ml_system_flow_col], elution_ml, side="left")
-        sample_elution_index = np.searchsorted(df[ml_sample_flow_col], elution_ml, side="left")
-        sample_flow = round(df[ml_sample_flow_col][sample_elution_index], 2)
-        system_flow = round(df[ml_system_flow_col][system_elution_index ], 2)
-    elif 'Elution 1' in run_log:
-        elution_idx = useful_log_idx[run_log.index('Elution 1')]
-        elution_ml = df[ml_log_col][elution_idx]
-        system_elution_index = np.searchsorted(df[ml_system_flow_col], elution_ml, side="left")
-        sample_elution_index = np.searchsorted(df[ml_sample_flow_col], elution_ml, side="left")
-        sample_flow = round(df[ml_sample_flow_col][sample_elution_index], 2)
-        system_flow = round(df[ml_system_flow_col][system_elution_index ], 2)
-    else:
-        sample_flow = None
-        system_flow = None
-    return sample_flow, system_flow
+    if phases is None:
+        phases = PhaseIndex(df, data_dict)
+    return get_sample_and_sytem_flow_rate_at_phase(df, data_dict, phases, 'Elution', 'Elution 1')
 
-def get_sample_and_sytem_flow_rate_at_equilibration(df, data_dict):
+def get_sample_and_sytem_flow_rate_at_equilibration(df, data_dict, phases=None):
     """
     This function takes in a dataframe and a dictionary with useful data and returns the sample and system flow rate at equilibration.
     Args:
         df: dataframe
         data_dict: dictionary with useful data
+        phases: PhaseIndex of the run (built from df if None)
     Returns:
         sample_flow: sample flow rate at equilibration
         system_flow: system flow rate at equilibration
     """
-    ml_sample_flow_col = data_dict['Sample Flow'][0]
-    ml_system_flow_col = data_dict['System Flow'][0]
-    ml_log_col = data_dict['Run Log'][0]
-
-    run_log, useful_log_idx = get_useful_log_idx(df)
+    if phases is None:
+        phases = PhaseIndex(df, data_dict)
+    return get_sample_and_sytem_flow_rate_at_phase(df, data_dict, phases, 'Equilibration')
 
-    if 'Equilibration' in run_log:
-        equilibration_idx = useful_log_idx[run_log.index('Equilibration')]
-        equilibration_ml = df[ml_log_col][equilibration_idx]
-        system_equilibration_index = np.searchsorted(df[ml_system_flow_col], equilibration_ml, side="left")
-        sample_equilibration_index = np.searchsorted(df[ml_sample_flow_col], equilibration_ml, side="left")
-        sample_flow = round(df[ml_sample_flow_col][sample_equilibration_index], 2)
-        system_flow = round(df[ml_system_flow_col][system_equilibration_index], 2)
-    else:
-        sample_flow = None
-        system_flow = None
-    return sample_flow, system_flow
-
-def get_sample_volume(df, data_dict):
+def get_sample_volume(df, data_dict, phases=None):
     """
     This function takes in a dataframe and a dictionary with useful data and returns the sample volume.
     Args:
         df: dataframe
         data_dict: dictionary with useful data
+        phases: PhaseIndex of the run (built from df if None)
     Returns:
         sample_volume: sample volume
     """
-    ml_log_col = data_dict['Run Log'][0]
-
-    run_log, useful_log_idx = get_useful_log_idx(df)
-
-    if 'Column Wash' in run_log:
-        column_wash_idx = useful_log_idx[run_log.index('Column Wash')]
-    elif 'Column Wash 1' in run_log:
-        column_wash_idx = useful_log_idx[run_log.index('Column Wash 1')]
-    else:   
-        column_wash_idx = None
+    if phases is None:
+        phases = PhaseIndex(df, data_dict)
+    column_wash_ml = phases.volume('Column Wash', 'Column Wash 1')
+    sample_application_ml = phases.volume('Sample Application')
 
-    if 'Sample Application' in run_log:
-        sample_application_idx = useful_log_idx[run_log.index('Sample Application')]
-    else:
-        sample_application_idx = None
-    
-    if column_wash_idx is not None and sample_application_idx is not None:
-        sample_volume = df[ml_log_col][column_wash_idx] - df[ml_log_col][sample_application_idx]
+    if column_wash_ml is not None and sample_application_ml is not None:
+        sample_volume = column_wash_ml - sample_application_ml
     else:
         sample_volume = None
     return sample_volume
 
+PROCESS_CHANNELS = ('pH', 'Conductivity', 'Sample Flow', 'System Flow', 'Sample Pressure', 'System Pressure',
+                    'UV_280', 'UV_260')
+
+def get_process_parameters(df, data_dict, phases=None, channels=PROCESS_CHANNELS, interpolate=False):
+    """
+    This function takes in a dataframe and a dictionary with useful data and returns the value of every
+    channel at the start of every phase of the run, with one batched lookup per channel.
+    Args:
+        df: dataframe
+        data_dict: dictionary with useful data
+        phases: PhaseIndex of the run (built from df if None)
+        channels: keys of data_dict to look up
+        interpolate: interpolate between samples instead of taking the first sample at/after the phase start
+    Returns:
+        record: dictionary with '<phase> <channel> (start)': value (rounded to 2 decimals, None if out of range)
+    """
+    if phases is None:
+        phases = PhaseIndex(df, data_dict)
+    names = list(dict.fromkeys(phases.names))
+    volumes = [phases.volume(name) for name in names]
+    record = {}
+    for channel in channels:
+        ml_col, col = data_dict[channel]
+        values = values_at_volumes(df[ml_col], df[col], volumes, interpolate)
+        for name, value in zip(names, values):
+            record[f'{name} {channel} (start)'] = None if np.isnan(value) else round(float(value), 2)
+    return record
+
+def get_phase_statistics(df, data_dict, phases=None, channels=PROCESS_CHANNELS):
+    """
+    This function takes in a dataframe and a dictionary with useful data and returns mean, std, min, max,
+    slope and integral of every channel over every phase of the run (from its start to the start of the
+    next phase, the last phase to the end of the curve). A phase that is run more than once is pooled
+    over all of its windows.
+    Args:
+        df: dataframe
+        data_dict: dictionary with useful data
+        phases: PhaseIndex of the run (built from df if None)
+        channels: keys of data_dict to summarise
+    Returns:
+        record: dictionary with '<phase> <channel> <statistic>': value (None for phases without samples)
+    """
+    if phases is None:
+        phases = PhaseIndex(df, data_dict)
+    names = list(dict.fromkeys(phases.names))
+    groups = [names.index(name) for name in phases.names]
+    record = {}
+    for channel in channels:
+        ml_col, col = data_dict[channel]
+        stats = window_stats(df[ml_col], df[col], phases.volumes, groups)
+        for key, values in stats.items():
+            for name, value in zip(names, values):
+                record[f'{name} {channel} {key}'] = None if np.isnan(value) else float(value)
+    return record
+
+def get_file_info(path, name):
+    """
+    This function takes in the path and name of a run file and returns the metadata encoded in the name.
+    Args:
+        path: path of the file
+        name: name of the file without extension
+    Returns:
+        info: dictionary with resin, serotype, file, Pure and Blank
+    """
+    resin, serotype = get_resin_and_serotype(name)
+    if serotype == 'U':
+        serotype = path.split('/')[-2]
+    return {'resin': resin, 'serotype': serotype, 'file': name, 'Pure': is_pure(name), 'Blank': is_blank(name)}
+
+def get_run_features(df, data_dict, all_phases=False, phase_stats=False):
+    """
+    This function takes in a dataframe and a dictionary with useful data and returns the process features of the run.
+    Args:
+        df: dataframe
+        data_dict: dictionary with useful data
+        all_phases: also return every phase x channel value (see get_process_parameters)
+        phase_stats: also return the statistics of every phase x channel window (see get_phase_statistics)
+    Returns:
+        features: dictionary with the feature columns of the collated table
+    """
+    phases = PhaseIndex(df, data_dict)
+    elution_ph, elution_cond = get_ph_and_cond_at_elution(df, data_dict, phases)
+    wash_ph, wash_cond = get_ph_and_cond_at_wash(df, data_dict, phases)
+    sample_flow, system_flow = get_sample_and_sytem_flow_rate_at_elution(df, data_dict, phases)
+    equilibration_ph, equilibration_cond = get_ph_and_cond_at_equilibration(df, data_dict, phases)
+    sample_volume = get_sample_volume(df, data_dict, phases)
+    chrom_id = get_chrom_id(df, data_dict)
+    column_volume = get_column_volume_xlsx(df, data_dict)
+
+    if column_volume == None or sample_flow == None:
+        retention_time = None
+    else:
+        retention_time = column_volume / (sample_flow/120)
+    features = {'Elution pH': elution_ph, 'Wash pH': wash_ph, 'Equlibration pH': equilibration_ph,
+            'Elution Conductivity': elution_cond, 'Wash Conductivity': wash_cond,
+            'Equilibration Conductivity': equilibration_cond, 'Sample Volume (mL)': sample_volume,
+            'System Flowrate Elution (CV/h)': system_flow, 'Sample Flowrate Elution (CV/h)': sample_flow,
+            'ChromID': chrom_id, 'Column Volume (mL)': column_volume,
+            'Retention Time (min)': retention_time, 'Sample flowrate (CV/h)': sample_flow}
+    if all_phases:
+        features.update(get_process_parameters(df, data_dict, phases))
+    if phase_stats:
+        features.update(get_phase_statistics(df, data_dict, phases))
+    return features
+
 
 def get_start_stop_idx(dataframe):
     two_elutions = False
@@ -499,9 +559,18 @@ def get_start_stop_idx(dataframe):
 
 
 def query_line(volume, results):
-    row_0 = [i for i in results[0]]
-    row_1 = [volume[round(i)] for i in results[1]]
-    row_2 = [volume[round(i)] for i in results[2]]
+    """
+    This function takes in the volume axis of a run and the width heights, left and right positions of
+    peak_widths and returns the width lines in volumes (positions interpolated between samples).
+    Args:
+        volume: volumes of the run
+        results: peak_widths(...)[1:]
+    Returns:
+        [heights, left volumes, right volumes]
+    """
+    row_0 = np.asarray(results[0], dtype=float)
+    row_1 = index_to_volume(volume, results[1])
+    row_2 = index_to_volume(volume, results[2])
     return [row_0, row_1, row_2]
 
 def show_peaks(name, uv_280, volume, peaks, half_width, contour_heights):